@@ -0,0 +1,250 @@
+"""Archive of old, settled transactions.
+
+archive_batch() moves SUCCESSFUL and FAILED transactions created more than
+ARCHIVE_AFTER_DAYS ago out of the transactions table and into gzip JSONL
+files under ARCHIVE_DIR, one file per chunk of ARCHIVE_CHUNK_SIZE rows, so
+memory stays bounded by one chunk. Each file is a series of gzip members of
+ARCHIVE_BLOCK_ROWS lines. transaction_archive_index records which file and
+member holds every archived row, so a lookup by external_id or
+momo_reference_id decompresses one small block instead of a whole file.
+
+Rollups keep counting archived transactions; there is no delete trigger.
+
+    python archive.py run    # archive everything that is due, chunk by chunk
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Optional
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
+from models import Transaction, TransactionArchiveIndex
+from crud import TERMINAL_STATUSES
+import leases
+import metrics
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = settings.archive_dir
+ARCHIVE_AFTER_DAYS = settings.archive_after_days
+ARCHIVE_CHUNK_SIZE = settings.archive_chunk_size
+ARCHIVE_BLOCK_ROWS = settings.archive_block_rows
+# Seconds between background archive runs; 0 leaves archiving to `python archive.py run`
+ARCHIVE_INTERVAL = settings.archive_interval
+
+ARCHIVE_COLUMNS = [column.name for column in Transaction.__table__.columns]
+
+_stats = {
+    "running": False,
+    # Whether this worker holds the archive lease and does the periodic runs
+    "leader": False,
+    "last_run_at": None,
+    "archived_total": 0,
+    "files_total": 0,
+    "errors_total": 0,
+}
+_task = None
+
+metrics.Counter("archive_transactions_total", "Transactions moved to the archive", function=lambda: _stats["archived_total"])
+metrics.Counter("archive_files_total", "Archive files written", function=lambda: _stats["files_total"])
+metrics.Counter("archive_errors_total", "Failed archive runs", function=lambda: _stats["errors_total"])
+
+
+def get_stats() -> dict:
+    return dict(_stats)
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def write_archive_file(path: str, rows: list) -> list:
+    """Write rows as gzip JSONL, one gzip member per block; returns each row's member offset"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    offsets = []
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        for start in range(0, len(rows), ARCHIVE_BLOCK_ROWS):
+            block = rows[start:start + ARCHIVE_BLOCK_ROWS]
+            offset = f.tell()
+            lines = "".join(json.dumps({key: _json_value(row[key]) for key in ARCHIVE_COLUMNS}) + "\n" for row in block)
+            f.write(gzip.compress(lines.encode()))
+            offsets.extend([offset] * len(block))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return offsets
+
+
+def read_archived(path: str, offset: int, transaction_id: str) -> Optional[dict]:
+    """Find one row by decompressing from the gzip member at `offset`"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        with gzip.GzipFile(fileobj=f) as block:
+            for line in block:
+                row = json.loads(line)
+                if row["id"] == transaction_id:
+                    return row
+    return None
+
+
+def iter_archived(paths):
+    """Every row in the given archive files (relative to ARCHIVE_DIR), streamed line by line"""
+    for relative in paths:
+        with gzip.open(os.path.join(ARCHIVE_DIR, relative), "rt") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+async def archive_batch(db: AsyncSession, cutoff: datetime) -> int:
+    """Move up to ARCHIVE_CHUNK_SIZE settled transactions created before `cutoff` into one archive file.
+
+    The rows are deleted with DELETE ... RETURNING, the file is written,
+    and the index rows are inserted in the same database transaction, so
+    concurrent archivers never take the same row and a failed commit
+    leaves the rows in place (its file is removed).
+    """
+    due = (
+        select(Transaction.id)
+        .where(Transaction.status.in_(TERMINAL_STATUSES), Transaction.created_at < cutoff)
+        .order_by(Transaction.created_at, Transaction.id)
+        .limit(ARCHIVE_CHUNK_SIZE)
+    )
+    result = await db.execute(
+        delete(Transaction)
+        .where(Transaction.id.in_(due.scalar_subquery()))
+        .returning(*Transaction.__table__.columns)
+        .execution_options(synchronize_session=False)
+    )
+    rows = sorted((dict(row._mapping) for row in result.all()), key=lambda row: (row["created_at"], row["id"]))
+    if not rows:
+        await db.rollback()
+        return 0
+
+    relative = os.path.join(rows[0]["created_at"].strftime("%Y/%m/%d"), f"transactions-{uuid.uuid4().hex}.jsonl.gz")
+    path = os.path.join(ARCHIVE_DIR, relative)
+    # Compression is CPU-bound; keep it off the event loop
+    offsets = await asyncio.to_thread(write_archive_file, path, rows)
+    try:
+        await db.execute(insert(TransactionArchiveIndex), [
+            {
+                "transaction_id": row["id"],
+                "external_id": row["external_id"],
+                "momo_reference_id": row["momo_reference_id"],
+                "archive_file": relative,
+                "block_offset": offset,
+                "created_at": row["created_at"],
+                "archived_at": datetime.utcnow(),
+            }
+            for row, offset in zip(rows, offsets)
+        ])
+        await db.commit()
+    except BaseException:
+        os.remove(path)
+        raise
+    _stats["archived_total"] += len(rows)
+    _stats["files_total"] += 1
+    return len(rows)
+
+
+async def run(after_days: float = None, renew_lease: bool = False) -> int:
+    """Archive every due transaction, one chunk per database transaction; returns the row count.
+
+    With renew_lease the archive lease is renewed between chunks, and the
+    run stops if another worker has taken it over.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS if after_days is None else after_days)
+    archived = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            count = await archive_batch(db, cutoff)
+        archived += count
+        if count < ARCHIVE_CHUNK_SIZE:
+            break
+        if renew_lease and not await leases.acquire("archive", ARCHIVE_INTERVAL):
+            _stats["leader"] = False
+            logger.warning("Archive lease lost after %d rows, stopping", archived)
+            return archived
+    _stats["last_run_at"] = datetime.utcnow().isoformat()
+    return archived
+
+
+async def lookup(db: AsyncSession, external_id: str = None, reference_id: str = None) -> Optional[dict]:
+    """An archived transaction by external_id or momo_reference_id, or None.
+
+    An indexed file that is missing from ARCHIVE_DIR is logged and treated
+    as not found, rather than failing the request.
+    """
+    query = select(TransactionArchiveIndex)
+    if reference_id:
+        query = query.where(TransactionArchiveIndex.momo_reference_id == reference_id)
+    else:
+        query = query.where(TransactionArchiveIndex.external_id == external_id)
+    entry = (await db.execute(query.limit(1))).scalars().first()
+    if not entry:
+        return None
+    path = os.path.join(ARCHIVE_DIR, entry.archive_file)
+    try:
+        return await asyncio.to_thread(read_archived, path, entry.block_offset, entry.transaction_id)
+    except FileNotFoundError:
+        logger.error("Archive file %s for transaction %s is missing", path, entry.transaction_id)
+        return None
+
+
+async def _run():
+    while True:
+        try:
+            # One worker archives for the whole deployment; the others stand by
+            _stats["leader"] = await leases.acquire("archive", ARCHIVE_INTERVAL)
+            if _stats["leader"]:
+                await run(renew_lease=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            _stats["errors_total"] += 1
+            logger.exception("Archive run failed")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+
+def start():
+    """Start periodic archiving on the running event loop, if ARCHIVE_INTERVAL is set"""
+    global _task
+    if ARCHIVE_INTERVAL > 0 and _task is None:
+        _task = asyncio.create_task(_run())
+        _stats["running"] = True
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+        if _stats["leader"]:
+            await leases.release("archive")
+        _stats.update(running=False, leader=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["run"])
+    parser.add_argument("--after-days", type=float, help=f"archive window in days (default ARCHIVE_AFTER_DAYS={ARCHIVE_AFTER_DAYS:g})")
+    args = parser.parse_args()
+
+    archived = asyncio.run(run(args.after_days))
+    print(f"Archived {archived} transactions to {ARCHIVE_DIR}")
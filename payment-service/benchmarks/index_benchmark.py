@@ -0,0 +1,167 @@
+"""Measure transaction lookup latency with and without the table indexes.
+
+Seeds a local database with synthetic transactions, times the hot queries
+with only the primary key and momo_reference_id indexes in place, then
+creates the indexes from models.Transaction and times them again.
+
+    python benchmarks/index_benchmark.py --rows 1000000
+    python benchmarks/index_benchmark.py --database-url postgresql://localhost/momo_bench
+
+Use a throwaway database: the transactions table is dropped and recreated.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STATUSES = ["SUCCESSFUL"] * 90 + ["FAILED"] * 8 + ["PENDING"] * 2
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="sqlite:///bench_indexes.db")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch", type=int, default=10_000, help="rows per insert batch")
+    parser.add_argument("--iterations", type=int, default=50, help="timed runs per query")
+    parser.add_argument("--json", action="store_true", help="print results as JSON only")
+    return parser.parse_args()
+
+
+def seed(engine, table, rows: int, batch: int):
+    start = datetime.utcnow() - timedelta(days=365)
+    step = timedelta(days=365) / max(rows, 1)
+    external_ids = []
+    with engine.begin() as conn:
+        for offset in range(0, rows, batch):
+            chunk = []
+            for i in range(offset, min(offset + batch, rows)):
+                created_at = start + step * i
+                external_id = f"ext-{i}"
+                chunk.append({
+                    "id": str(uuid.uuid4()),
+                    "momo_reference_id": str(uuid.uuid4()),
+                    "external_id": external_id,
+                    "amount": round(random.uniform(1, 500), 2),
+                    "currency": random.choice(["GHS", "EUR"]),
+                    "payer_phone_number": "233500000001",
+                    "status": random.choice(STATUSES),
+                    "created_at": created_at,
+                    "updated_at": created_at,
+                })
+                if i % 1000 == 0:
+                    external_ids.append(external_id)
+            conn.execute(table.insert(), chunk)
+    return external_ids
+
+
+def queries(table, external_ids):
+    from sqlalchemy import select
+
+    end = datetime.utcnow()
+    return {
+        "lookup_by_external_id": lambda: select(table).where(table.c.external_id == random.choice(external_ids)),
+        "pending_scan": lambda: (
+            select(table.c.id, table.c.momo_reference_id, table.c.created_at)
+            .where(table.c.status == "PENDING")
+            .order_by(table.c.created_at, table.c.id)
+            .limit(200)
+        ),
+        "status_filter_page": lambda: (
+            select(table)
+            .where(table.c.status == "FAILED")
+            .order_by(table.c.created_at.desc(), table.c.id.desc())
+            .limit(100)
+        ),
+        "time_range_page": lambda: (
+            select(table)
+            .where(table.c.created_at >= end - timedelta(days=random.randint(30, 300)))
+            .order_by(table.c.created_at.desc(), table.c.id.desc())
+            .limit(100)
+        ),
+    }
+
+
+def measure(engine, table, external_ids, iterations: int) -> dict:
+    results = {}
+    with engine.connect() as conn:
+        for name, build in queries(table, external_ids).items():
+            timings = []
+            for _ in range(iterations):
+                query = build()
+                started = time.perf_counter()
+                conn.execute(query).fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            results[name] = {
+                "p50_ms": round(statistics.median(timings), 3),
+                "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3),
+                "mean_ms": round(statistics.fmean(timings), 3),
+            }
+    return results
+
+
+def analyze(engine):
+    from sqlalchemy import text
+
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("DATABASE_URL", args.database_url)
+
+    from sqlalchemy import create_engine
+    from models import Transaction
+
+    engine = create_engine(args.database_url)
+    table = Transaction.__table__
+    table.drop(engine, checkfirst=True)
+    table.create(engine)
+    # Start from the baseline schema: only the primary key and unique momo_reference_id
+    for index in table.indexes:
+        index.drop(engine)
+
+    started = time.perf_counter()
+    external_ids = seed(engine, table, args.rows, args.batch)
+    seed_seconds = time.perf_counter() - started
+    analyze(engine)
+    before = measure(engine, table, external_ids, args.iterations)
+
+    started = time.perf_counter()
+    for index in table.indexes:
+        index.create(engine)
+    index_seconds = time.perf_counter() - started
+    analyze(engine)
+    after = measure(engine, table, external_ids, args.iterations)
+
+    report = {
+        "database": engine.url.get_backend_name(),
+        "rows": args.rows,
+        "seed_seconds": round(seed_seconds, 2),
+        "index_build_seconds": round(index_seconds, 2),
+        "before": before,
+        "after": after,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{args.rows} rows on {report['database']} (seeded in {report['seed_seconds']}s, "
+          f"indexes built in {report['index_build_seconds']}s)")
+    print(f"{'query':<24}{'before p50':>12}{'after p50':>12}{'speedup':>10}")
+    for name in before:
+        b, a = before[name]["p50_ms"], after[name]["p50_ms"]
+        speedup = f"{b / a:.1f}x" if a else "-"
+        print(f"{name:<24}{b:>10.3f}ms{a:>10.3f}ms{speedup:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""Load-test the payment service against the local MoMo stub.
+
+Starts benchmarks/momo_stub.py and the payment service (uvicorn main:app)
+as subprocesses on a throwaway database, runs the scenarios below and
+prints one JSON report with p50/p95/p99 latency and requests/sec each.
+
+    payment_request      POST /payment/request throughput
+    status_poll_storm    many clients polling GET /payment/status for a few ids
+    list_transactions    walking GET /transactions pages at growing table sizes
+
+    python benchmarks/load_test.py --output bench.json
+    python benchmarks/load_test.py --compare bench.json   # exit 1 on regression
+    python benchmarks/load_test.py --database-url postgresql://localhost/momo_bench
+
+Stub faults are set with the STUB_* variables documented in momo_stub.py;
+any other environment variables (RECONCILER_ENABLED, DB_POOL_SIZE, ...)
+are passed through to the service.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(HERE)
+sys.path.insert(0, SERVICE_DIR)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="throwaway database (default: temporary SQLite file)")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--poll-ids", type=int, default=10, help="payments polled in the status storm")
+    parser.add_argument("--table-sizes", default="1000,10000,100000", help="row counts for list_transactions")
+    parser.add_argument("--scenarios", default="payment_request,status_poll_storm,list_transactions")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--compare", help="baseline report; exit 1 if p95 or rps regress beyond --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (0.2 = 20%%)")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_process(args, env, port):
+    process = subprocess.Popen(args, env=env, cwd=SERVICE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(args)} exited: {process.stderr.read().decode()[-2000:]}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{' '.join(args)} did not start on port {port}")
+
+
+def summarize(latencies: list, statuses: Counter, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3)
+
+    errors = sum(count for code, count in statuses.items() if not str(code).startswith("2"))
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "status_codes": {str(code): count for code, count in sorted(statuses.items(), key=str)},
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+async def run_load(client: httpx.AsyncClient, make_request, total: int, concurrency: int) -> dict:
+    """Issue `total` requests from `concurrency` workers; make_request(i) returns a coroutine"""
+    latencies = []
+    statuses = Counter()
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                response = await make_request(i)
+                statuses[response.status_code] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+def payment_body(i: int) -> dict:
+    return {"amount": str(random.randint(1, 500)), "currency": "EUR", "payer_phone_number": f"2335{i:08d}"}
+
+
+async def scenario_payment_request(client, args) -> dict:
+    return await run_load(
+        client,
+        lambda i: client.post("/payment/request", json=payment_body(i)),
+        args.requests,
+        args.concurrency,
+    )
+
+
+async def scenario_status_poll_storm(client, args) -> dict:
+    reference_ids = []
+    for i in range(args.poll_ids):
+        response = await client.post("/payment/request", json=payment_body(i))
+        response.raise_for_status()
+        reference_ids.append(response.json()["reference_id"])
+    return await run_load(
+        client,
+        lambda i: client.get(f"/payment/status/{reference_ids[i % len(reference_ids)]}"),
+        args.requests,
+        args.concurrency,
+    )
+
+
+async def scenario_list_transactions(client, args, database_url) -> dict:
+    from sqlalchemy import create_engine, func, select
+    from index_benchmark import seed
+    from models import Transaction
+
+    engine = create_engine(database_url)
+    results = {}
+    for size in sorted(int(size) for size in args.table_sizes.split(",")):
+        with engine.connect() as conn:
+            current = conn.execute(select(func.count()).select_from(Transaction.__table__)).scalar()
+        if size > current:
+            await asyncio.to_thread(seed, engine, Transaction.__table__, size - current, 10_000)
+
+        cursors = [None]
+
+        async def page(i):
+            # Walk forward through the cursor chain, restarting at the newest page
+            cursor = cursors[i % len(cursors)]
+            params = {"limit": 100, **({"cursor": cursor} if cursor else {})}
+            response = await client.get("/transactions", params=params)
+            if response.status_code == 200 and len(cursors) < 50:
+                next_cursor = response.json().get("next_cursor")
+                if next_cursor:
+                    cursors.append(next_cursor)
+            return response
+
+        results[str(size)] = await run_load(client, page, args.requests, args.concurrency)
+    engine.dispose()
+    return results
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Regression messages for every scenario slower than the baseline by more than `tolerance`"""
+    def flatten(scenarios):
+        for name, result in scenarios.items():
+            if "p95_ms" in result:
+                yield name, result
+            else:
+                for size, sized in result.items():
+                    yield f"{name}[{size}]", sized
+
+    current = dict(flatten(report["scenarios"]))
+    regressions = []
+    for name, old in flatten(baseline.get("scenarios", {})):
+        new = current.get(name)
+        if not new or not old.get("p95_ms") or not new.get("p95_ms"):
+            continue
+        if new["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old['p95_ms']}ms -> {new['p95_ms']}ms")
+        if old.get("rps") and new.get("rps") and new["rps"] < old["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {old['rps']} -> {new['rps']}")
+    return regressions
+
+
+async def run(args, database_url: str, service_url: str) -> dict:
+    scenarios = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=service_url, limits=limits, timeout=60) as client:
+        for name in args.scenarios.split(","):
+            if name == "payment_request":
+                scenarios[name] = await scenario_payment_request(client, args)
+            elif name == "status_poll_storm":
+                scenarios[name] = await scenario_status_poll_storm(client, args)
+            elif name == "list_transactions":
+                scenarios[name] = await scenario_list_transactions(client, args, database_url)
+            else:
+                raise SystemExit(f"Unknown scenario: {name}")
+    return scenarios
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="momo-bench-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    stub_port, service_port = free_port(), free_port()
+
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url,
+        "MOMO_BASE_URL": f"http://127.0.0.1:{stub_port}",
+        "SUBSCRIPTION_PRIMARY_KEY": "bench",
+        "API_USER_ID": "bench-user",
+        "API_KEY": "bench-key",
+        "TARGET_ENVIRONMENT": "sandbox",
+    })
+    os.environ["DATABASE_URL"] = database_url
+
+    from database import Base, engine
+    import models  # noqa: F401 - registers the tables on Base.metadata
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    processes = []
+    try:
+        processes.append(start_process(
+            [sys.executable, "-m", "uvicorn", "momo_stub:app", "--app-dir", HERE,
+             "--port", str(stub_port), "--log-level", "warning"],
+            env, stub_port,
+        ))
+        processes.append(start_process(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(service_port), "--log-level", "warning"],
+            env, service_port,
+        ))
+        started = time.time()
+        scenarios = asyncio.run(run(args, database_url, f"http://127.0.0.1:{service_port}"))
+        stub_stats = httpx.get(f"http://127.0.0.1:{stub_port}/_stats").json()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=10)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(started)),
+            "database": database_url.split("://")[0],
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "duration_seconds": round(time.time() - started, 2),
+            "stub": {key: value for key, value in os.environ.items() if key.startswith("STUB_")},
+            "upstream_calls": stub_stats,
+        },
+        "scenarios": scenarios,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
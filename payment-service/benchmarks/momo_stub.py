@@ -0,0 +1,139 @@
+"""Local stand-in for the MTN MoMo collection API, for benchmarks.
+
+Implements the token, requesttopay and requesttopay status endpoints with
+configurable latency and fault injection, all read from the environment:
+
+    STUB_LATENCY_MS      base response latency (default 50)
+    STUB_JITTER_MS       extra uniform random latency (default 10)
+    STUB_ERROR_RATE      share of requests answered with 500 (default 0)
+    STUB_401_RATE        share of API calls rejected with 401 (default 0)
+    STUB_429_RATE        share of requests throttled with 429 (default 0)
+    STUB_TOKEN_TTL       expires_in of issued tokens, seconds (default 3600)
+    STUB_SETTLE_AFTER    seconds before a payment leaves PENDING (default 1)
+    STUB_FAILURE_RATIO   share of settled payments that end FAILED (default 0)
+
+    uvicorn momo_stub:app --app-dir benchmarks --port 9100
+
+GET /_stats returns request counters; POST /_reset clears them.
+"""
+import asyncio
+import os
+import random
+import time
+import uuid
+from collections import Counter
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "50"))
+JITTER_MS = float(os.getenv("STUB_JITTER_MS", "10"))
+ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+UNAUTHORIZED_RATE = float(os.getenv("STUB_401_RATE", "0"))
+THROTTLE_RATE = float(os.getenv("STUB_429_RATE", "0"))
+TOKEN_TTL = int(os.getenv("STUB_TOKEN_TTL", "3600"))
+SETTLE_AFTER = float(os.getenv("STUB_SETTLE_AFTER", "1"))
+FAILURE_RATIO = float(os.getenv("STUB_FAILURE_RATIO", "0"))
+
+app = FastAPI(title="MoMo stub")
+
+_payments = {}
+_tokens = set()
+_counters = Counter()
+
+
+async def _delay():
+    await asyncio.sleep((LATENCY_MS + random.uniform(0, JITTER_MS)) / 1000)
+
+
+def _injected_fault(check_auth: bool, request: Request):
+    """Response for an injected failure, or None to answer normally"""
+    if random.random() < THROTTLE_RATE:
+        _counters["429"] += 1
+        return JSONResponse(status_code=429, content={"message": "Too many requests"}, headers={"Retry-After": "1"})
+    if random.random() < ERROR_RATE:
+        _counters["500"] += 1
+        return JSONResponse(status_code=500, content={"message": "Internal error"})
+    if check_auth:
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if token not in _tokens or random.random() < UNAUTHORIZED_RATE:
+            _counters["401"] += 1
+            return JSONResponse(status_code=401, content={"message": "Access token is invalid"})
+    return None
+
+
+@app.post("/collection/token/")
+async def token(request: Request):
+    _counters["token"] += 1
+    await _delay()
+    fault = _injected_fault(False, request)
+    if fault:
+        return fault
+    access_token = uuid.uuid4().hex
+    _tokens.add(access_token)
+    return {"access_token": access_token, "token_type": "access_token", "expires_in": TOKEN_TTL}
+
+
+@app.post("/collection/v1_0/requesttopay")
+async def request_to_pay(request: Request):
+    _counters["requesttopay"] += 1
+    await _delay()
+    fault = _injected_fault(True, request)
+    if fault:
+        return fault
+    reference_id = request.headers.get("X-Reference-Id")
+    if not reference_id:
+        return JSONResponse(status_code=400, content={"message": "X-Reference-Id is required"})
+    if reference_id in _payments:
+        return JSONResponse(status_code=409, content={"message": "Duplicated reference id"})
+    _payments[reference_id] = {
+        "payload": await request.json(),
+        "created": time.monotonic(),
+        "final": "FAILED" if random.random() < FAILURE_RATIO else "SUCCESSFUL",
+    }
+    return Response(status_code=202)
+
+
+@app.get("/collection/v1_0/requesttopay/{reference_id}")
+async def request_to_pay_status(reference_id: str, request: Request):
+    _counters["status"] += 1
+    await _delay()
+    fault = _injected_fault(True, request)
+    if fault:
+        return fault
+    payment = _payments.get(reference_id)
+    if payment is None:
+        return JSONResponse(status_code=404, content={"code": "RESOURCE_NOT_FOUND"})
+    payload = payment["payload"]
+    settled = time.monotonic() - payment["created"] >= SETTLE_AFTER
+    status = payment["final"] if settled else "PENDING"
+    body = {
+        "amount": payload.get("amount"),
+        "currency": payload.get("currency"),
+        "externalId": payload.get("externalId"),
+        "payer": payload.get("payer"),
+        "payerMessage": payload.get("payerMessage"),
+        "payeeNote": payload.get("payeeNote"),
+        "status": status,
+    }
+    if status == "SUCCESSFUL":
+        body["financialTransactionId"] = str(abs(hash(reference_id)))[:9]
+    if status == "FAILED":
+        body["reason"] = "APPROVAL_REJECTED"
+    return body
+
+
+@app.get("/_stats")
+async def stats():
+    return {"payments": len(_payments), "tokens_issued": len(_tokens), **_counters}
+
+
+@app.post("/_reset")
+async def reset():
+    _counters.clear()
+    return {"reset": True}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("STUB_PORT", "9100")), log_level="warning")
@@ -0,0 +1,204 @@
+import asyncio
+import math
+import time
+from collections import deque
+from fastapi import HTTPException
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+
+class UpstreamUnavailable(HTTPException):
+    """Raised instead of calling Momo when the breaker is open or the limiter is full.
+
+    FastAPI turns it into a 503 with Retry-After, so callers shed load fast.
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(
+            status_code=503,
+            detail=f"Momo API unavailable: {reason}",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker driven by error rate and slow-call rate.
+
+    While closed, calls from the last `window` seconds are kept. Once at
+    least `min_calls` are recorded and either the failure rate or the rate
+    of calls slower than `slow_call_seconds` crosses its threshold, the
+    breaker opens for `open_seconds`. It then lets `half_open_calls` probes
+    through: one failure re-opens it, all succeeding closes it.
+    """
+
+    def __init__(
+        self,
+        window: float = 30,
+        min_calls: int = 20,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 5,
+        slow_rate: float = 0.8,
+        open_seconds: float = 30,
+        half_open_calls: int = 3,
+    ):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.opened_total = 0
+        self._calls = deque()  # (timestamp, failed, slow)
+        self._failures = 0
+        self._slow = 0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+
+    def before_call(self):
+        """Raise UpstreamUnavailable unless a call may go through now"""
+        if self.state == OPEN:
+            remaining = self.opened_at + self.open_seconds - time.monotonic()
+            if remaining > 0:
+                raise UpstreamUnavailable("circuit open", remaining)
+            self.state = HALF_OPEN
+            self._probes_started = 0
+            self._probes_succeeded = 0
+        if self.state == HALF_OPEN:
+            if self._probes_started >= self.half_open_calls:
+                raise UpstreamUnavailable("circuit half-open, probing", 1)
+            self._probes_started += 1
+
+    def record(self, duration: float, failed: bool):
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            if failed:
+                self._open(now)
+            else:
+                self._probes_succeeded += 1
+                if self._probes_succeeded >= self.half_open_calls:
+                    self._close()
+            return
+        if self.state == OPEN:
+            # A call that started before the breaker opened
+            return
+
+        slow = duration >= self.slow_call_seconds
+        self._calls.append((now, failed, slow))
+        self._failures += failed
+        self._slow += slow
+        while self._calls and self._calls[0][0] < now - self.window:
+            _, old_failed, old_slow = self._calls.popleft()
+            self._failures -= old_failed
+            self._slow -= old_slow
+
+        total = len(self._calls)
+        if total >= self.min_calls and (
+            self._failures / total >= self.failure_rate or self._slow / total >= self.slow_rate
+        ):
+            self._open(now)
+
+    def cancel_call(self):
+        """Forget a call that was allowed through but never completed"""
+        if self.state == HALF_OPEN and self._probes_started > 0:
+            self._probes_started -= 1
+
+    def retry_after(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.open_seconds - time.monotonic())
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.opened_total += 1
+        self._calls.clear()
+        self._failures = 0
+        self._slow = 0
+
+    def _close(self):
+        self.state = CLOSED
+        self._calls.clear()
+        self._failures = 0
+        self._slow = 0
+
+    def stats(self) -> dict:
+        total = len(self._calls)
+        return {
+            "state": self.state,
+            "retry_after_seconds": round(self.retry_after(), 3),
+            "window_calls": total,
+            "window_failure_rate": round(self._failures / total, 4) if total else 0.0,
+            "window_slow_rate": round(self._slow / total, 4) if total else 0.0,
+            "opened_total": self.opened_total,
+        }
+
+
+class AdaptiveLimiter:
+    """AIMD limit on concurrent upstream calls.
+
+    The limit grows by about one per `limit` successful calls while latency
+    stays under `latency_target`, and shrinks by `backoff` on a failure or
+    slow call. Calls over the limit are rejected right away unless the
+    caller (a background job rather than a client request) asks to wait.
+    """
+
+    def __init__(self, initial: int = 50, min_limit: int = 5, max_limit: int = 200,
+                 latency_target: float = 2.0, backoff: float = 0.9):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.in_flight = 0
+        self.rejected_total = 0
+        self._released = None
+
+    async def acquire(self, wait: bool = False, timeout: float = None):
+        """Take a slot. Over the limit, raise right away, or with wait=True queue for up to `timeout`"""
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return
+        if not wait:
+            self.rejected_total += 1
+            raise UpstreamUnavailable("too many requests in flight", 1)
+
+        if self._released is None:
+            self._released = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while self.in_flight >= int(self.limit):
+            self._released.clear()
+            remaining = None if deadline is None else deadline - loop.time()
+            try:
+                await asyncio.wait_for(self._released.wait(), remaining)
+            except asyncio.TimeoutError:
+                self.rejected_total += 1
+                raise UpstreamUnavailable("too many requests in flight", 1)
+        self.in_flight += 1
+
+    def release(self, duration: float = None, failed: bool = False):
+        """Free a slot; pass duration=None when the call never reached upstream"""
+        self.in_flight -= 1
+        if self._released is not None:
+            self._released.set()
+        if duration is None:
+            return
+        if failed or duration > self.latency_target:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "rejected_total": self.rejected_total,
+        }
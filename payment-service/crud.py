@@ -0,0 +1,141 @@
+import base64
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Transaction
+from status_cache import status_cache
+from settings import settings
+
+# Statuses Momo will not change any more
+TERMINAL_STATUSES = ("SUCCESSFUL", "FAILED")
+# Statuses whose outcome is still to be read from Momo; an ERROR request-to-pay
+# may have reached Momo before the failure (timeout, lost response, Momo 5xx)
+UNCONFIRMED_STATUSES = ("PENDING", "ERROR")
+
+
+def status_update_from_momo(transaction_id: str, reference_id: str, payment_data: dict) -> dict:
+    """Build a row update for apply_status_updates from a Momo requesttopay payload"""
+    new_status = payment_data.get("status", "UNKNOWN")
+    return {
+        "id": transaction_id,
+        "momo_reference_id": reference_id,
+        "status": new_status,
+        "financial_transaction_id": payment_data.get("financialTransactionId") if new_status == "SUCCESSFUL" else None,
+        "updated_at": datetime.utcnow(),
+    }
+
+
+def never_received(status: str, updated_at: datetime) -> bool:
+    """Whether Momo answering 404 for a transaction means it never got the request-to-pay.
+
+    Only ERROR rows qualify, once any request still in flight when the row
+    was marked has had MOMO_TOTAL_TIMEOUT to arrive; nothing resends them.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.momo_total_timeout)
+    return status == "ERROR" and updated_at is not None and updated_at < cutoff
+
+
+def status_update_not_received(transaction_id: str, reference_id: str) -> dict:
+    """Row update for a request-to-pay Momo has no record of: it failed"""
+    return {
+        "id": transaction_id,
+        "momo_reference_id": reference_id,
+        "status": "FAILED",
+        "financial_transaction_id": None,
+        "updated_at": datetime.utcnow(),
+    }
+
+
+async def apply_status_updates(db: AsyncSession, updates: list):
+    """Write status changes with one bulk UPDATE by primary key.
+
+    Each update is a dict with "id", "momo_reference_id" and the columns to
+    set. Rows that already reached a terminal status are left untouched, so
+    late or repeated results can't overwrite a final one.
+    """
+    if not updates:
+        return
+    reference_ids = [values["momo_reference_id"] for values in updates]
+    await db.execute(
+        update(Transaction).where(*(Transaction.status != status for status in TERMINAL_STATUSES)),
+        [{key: value for key, value in values.items() if key != "momo_reference_id"} for values in updates],
+        execution_options={"synchronize_session": None},
+    )
+    await db.commit()
+    for reference_id in reference_ids:
+        status_cache.invalidate(reference_id)
+
+
+async def update_status_by_reference(db: AsyncSession, reference_id: str, values: dict, external_id: str = None) -> bool:
+    """Move one transaction to a new status by its Momo reference id.
+
+    Same guard as apply_status_updates; returns False when nothing changed
+    (unknown reference, external id mismatch, or already final).
+    """
+    query = (
+        update(Transaction)
+        .where(Transaction.momo_reference_id == reference_id)
+        .where(*(Transaction.status != status for status in TERMINAL_STATUSES))
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if external_id:
+        query = query.where(Transaction.external_id == external_id)
+    result = await db.execute(query)
+    await db.commit()
+    status_cache.invalidate(reference_id)
+    return result.rowcount > 0
+
+
+# Columns a client can pick with ?fields=
+TRANSACTION_FIELDS = tuple(column.name for column in Transaction.__table__.columns)
+
+
+def parse_fields(fields: str = None) -> tuple:
+    """Column names from a comma-separated ?fields= value, or every column when it is empty"""
+    if not fields:
+        return TRANSACTION_FIELDS
+    names = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in TRANSACTION_FIELDS]
+    if not names or unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown) or fields}. Choose from {', '.join(TRANSACTION_FIELDS)}")
+    return names
+
+
+def transaction_filters(status: str = None, currency: str = None, created_from: datetime = None, created_to: datetime = None) -> list:
+    """WHERE clauses for the transaction list and export endpoints"""
+    filters = []
+    if status:
+        filters.append(Transaction.status == status)
+    if currency:
+        filters.append(Transaction.currency == currency)
+    if created_from:
+        filters.append(Transaction.created_at >= created_from)
+    if created_to:
+        filters.append(Transaction.created_at < created_to)
+    return filters
+
+
+def encode_cursor(created_at: datetime, transaction_id: str) -> str:
+    """Opaque keyset cursor pointing at one (created_at, id) position"""
+    raw = json.dumps([created_at.isoformat(), transaction_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Inverse of encode_cursor, raises ValueError for anything malformed"""
+    try:
+        created_at, transaction_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), str(transaction_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def after_cursor(cursor: tuple):
+    """Rows strictly older than the cursor, in (created_at DESC, id DESC) order"""
+    created_at, transaction_id = cursor
+    return or_(
+        Transaction.created_at < created_at,
+        and_(Transaction.created_at == created_at, Transaction.id < transaction_id),
+    )
@@ -1,15 +1,57 @@
-import os
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+import metrics
+from settings import settings
 
-load_dotenv()
+DATABASE_URL = settings.database_url
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+# Connection pool settings per worker process, applied to both the sync and the async engine
+DB_POOL_SIZE, DB_MAX_OVERFLOW = settings.db_pool_limits()
+DB_POOL_TIMEOUT = settings.db_pool_timeout
+DB_POOL_RECYCLE = settings.db_pool_recycle
+DB_POOL_PRE_PING = settings.db_pool_pre_ping
 
-engine = create_engine(DATABASE_URL)
+# Async drivers used when DATABASE_URL does not name one
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_url(url: str) -> str:
+    """Turn DATABASE_URL into its async-driver equivalent, e.g. postgresql:// -> postgresql+asyncpg://"""
+    parsed = make_url(url)
+    if "+" in parsed.drivername:
+        return url
+    drivername = ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername)
+    return parsed.set(drivername=drivername).render_as_string(hide_password=False)
+
+
+def _pool_options(url: str) -> dict:
+    # SQLite uses its own pool classes that don't take sizing arguments
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+# Sync engine, for scripts such as test_db.py
+engine = create_engine(DATABASE_URL, **_pool_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine, used by the API routes
+async_engine = create_async_engine(get_async_url(DATABASE_URL), **_pool_options(DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -19,5 +61,21 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    with metrics.db_session_duration.time():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+# Commit timing for every session, sync or async (AsyncSession wraps a sync Session)
+@event.listens_for(Session, "before_commit")
+def _commit_started(session):
+    session.info["commit_started"] = time.perf_counter()
+
+@event.listens_for(Session, "after_commit")
+def _commit_finished(session):
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        metrics.db_commit_duration.observe(time.perf_counter() - started)
+
 def create_tables():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
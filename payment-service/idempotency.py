@@ -0,0 +1,126 @@
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import HTTPException
+from pydantic import BaseModel
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from cache import LRUCache
+from models import IdempotencyKey
+from settings import settings
+
+# How long a key protects against repeats, and how many completed keys stay in memory
+IDEMPOTENCY_TTL = settings.idempotency_ttl
+IDEMPOTENCY_CACHE_SIZE = settings.idempotency_cache_size
+# An in-flight reservation older than this can be taken over by a retry
+IDEMPOTENCY_LEASE_SECONDS = settings.idempotency_lease_seconds or 4 * settings.momo_total_timeout
+
+# Rejections that may succeed on retry (expired token, timeout, rate limit), so they are not replayed
+RETRYABLE_STATUS_CODES = (401, 408, 429)
+
+# key -> (request_hash, status_code, response_body), completed requests only
+_completed = LRUCache(maxsize=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL)
+
+
+def resolve_key(header_key: Optional[str], external_id: Optional[str]) -> Optional[str]:
+    """The Idempotency-Key header wins; a client-supplied external_id is the fallback"""
+    if header_key:
+        return f"key:{header_key}"
+    if external_id:
+        return f"external:{external_id}"
+    return None
+
+
+def request_hash(request: BaseModel) -> str:
+    body = json.dumps(request.model_dump(), sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def is_final(status_code: int) -> bool:
+    """Whether an error response should be stored and replayed for repeats of the key"""
+    return status_code < 500 and status_code not in RETRYABLE_STATUS_CODES
+
+
+def _check_hash(stored_hash: str, request_hash: str):
+    if stored_hash != request_hash:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency key was already used with a different request body"
+        )
+
+
+async def begin(db: AsyncSession, key: str, request_hash: str) -> Optional[tuple]:
+    """Claim `key` for this request.
+
+    Returns (status_code, body) of the original response when the key was
+    already completed, or None once the key is reserved for the caller.
+    The primary key on idempotency_keys makes the reservation atomic across
+    workers; a concurrent request with the same key gets a 409, until the
+    reservation is older than IDEMPOTENCY_LEASE_SECONDS and is taken over.
+    """
+    cached = _completed.get(key)
+    if cached:
+        _check_hash(cached[0], request_hash)
+        return cached[1], cached[2]
+
+    for _ in range(2):
+        row = await db.get(IdempotencyKey, key, populate_existing=True)
+        if row is not None and row.created_at < datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_TTL):
+            await db.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key))
+            await db.commit()
+            row = None
+        if row is not None:
+            _check_hash(row.request_hash, request_hash)
+            if row.status_code is None:
+                if row.created_at >= datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS):
+                    raise HTTPException(
+                        status_code=409,
+                        detail="A request with this idempotency key is still in progress"
+                    )
+                # The worker that reserved it died before completing: renew the lease for this request
+                result = await db.execute(
+                    update(IdempotencyKey)
+                    .where(
+                        IdempotencyKey.key == key,
+                        IdempotencyKey.status_code.is_(None),
+                        IdempotencyKey.created_at == row.created_at,
+                    )
+                    .values(created_at=datetime.utcnow())
+                )
+                await db.commit()
+                if result.rowcount == 1:
+                    return None
+                # Another retry took it over first, read what it holds now
+                continue
+            body = json.loads(row.response_body)
+            _completed.set(key, (row.request_hash, row.status_code, body))
+            return row.status_code, body
+
+        db.add(IdempotencyKey(key=key, request_hash=request_hash))
+        try:
+            await db.commit()
+            return None
+        except IntegrityError:
+            # Another worker reserved it first, read what it stored
+            await db.rollback()
+    raise HTTPException(status_code=409, detail="A request with this idempotency key is still in progress")
+
+
+async def complete(db: AsyncSession, key: str, request_hash: str, status_code: int, body: dict):
+    """Store the response so repeats of `key` get it back verbatim"""
+    await db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.key == key)
+        .values(status_code=status_code, response_body=json.dumps(body, default=str))
+    )
+    await db.commit()
+    _completed.set(key, (request_hash, status_code, body))
+
+
+async def release(db: AsyncSession, key: str):
+    """Forget a reservation whose request failed before Momo accepted it, so it can be retried"""
+    await db.rollback()
+    await db.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key))
+    await db.commit()
@@ -0,0 +1,69 @@
+"""Leases that let one worker process run a background job for the whole deployment.
+
+With several workers (serve.py) every process starts the reconciler and
+the archiver; each loop iteration first calls acquire(), and only the
+holder of the lease does the work. The holder renews the lease on every
+iteration and between the batches of a long run, stopping if it finds the
+lease taken, so it keeps the job until it stops or dies, after which the
+lease runs out and another worker takes over. Works across hosts that
+share the database, assuming their clocks roughly agree.
+"""
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from database import AsyncSessionLocal
+from models import BackgroundLease
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Slack on top of a job's interval before a silent holder is replaced; covers one slow run
+BACKGROUND_LEASE_SECONDS = settings.background_lease_seconds
+
+
+def holder() -> str:
+    # Computed per call: workers fork from the master after import, so the pid differs
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def acquire(name: str, interval: float) -> bool:
+    """Take or renew lease `name` for a job that runs every `interval` seconds; True if this process holds it"""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=interval + BACKGROUND_LEASE_SECONDS)
+    async with AsyncSessionLocal() as db:
+        # Under Postgres READ COMMITTED a concurrent taker re-checks the row after our commit and matches nothing
+        result = await db.execute(
+            update(BackgroundLease)
+            .where(BackgroundLease.name == name)
+            .where(or_(BackgroundLease.holder == holder(), BackgroundLease.expires_at < now))
+            .values(holder=holder(), expires_at=expires_at)
+        )
+        if result.rowcount:
+            await db.commit()
+            return True
+        db.add(BackgroundLease(name=name, holder=holder(), expires_at=expires_at))
+        try:
+            await db.commit()
+            return True
+        except IntegrityError:
+            # Held by another live worker
+            await db.rollback()
+            return False
+
+
+async def release(name: str):
+    """Give up lease `name` if this process holds it, so another worker takes over right away"""
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(BackgroundLease)
+                .where(BackgroundLease.name == name, BackgroundLease.holder == holder())
+                .values(expires_at=datetime.utcnow())
+            )
+            await db.commit()
+    except Exception:
+        # It runs out on its own
+        logger.exception("Releasing lease %s failed", name)
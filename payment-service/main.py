@@ -1,18 +1,39 @@
 from fastapi import BackgroundTasks, FastAPI, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-import os
-from dotenv import load_dotenv
-from utils import get_momo_token
+from contextlib import asynccontextmanager
 import routes
+import momo_client
+import reconciler
+import outbox
+import rollups
+import archive
+import metrics
+from database import async_engine
+from settings import settings
 
-#load environment variables
-load_dotenv()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled Momo client for the whole app
+    await momo_client.start_client()
+    reconciler.start()
+    outbox.start()
+    rollups.start()
+    archive.start()
+    yield
+    await archive.stop()
+    await rollups.stop()
+    # Let claimed outbox batches finish within the shutdown grace period
+    await outbox.stop(settings.shutdown_grace_seconds)
+    await reconciler.stop()
+    await momo_client.close_client()
+    await async_engine.dispose()
 
 #Api attributes
 app = FastAPI(
     title='Momo payment  Api',
     description="API for processing Mobile Money payments via MTN Momo",
-    version='1.0.0'
+    version='1.0.0',
+    lifespan=lifespan
 )
 
 #CORS middleware
@@ -24,25 +45,22 @@ app.add_middleware(
     allow_headers = ['*']
 )
 
-#from momo api 
-CONFIG = {
-    "SUBSCRIPTION_PRIMARY_KEY": os.getenv("SUBSCRIPTION_PRIMARY_KEY"),
-    "API_USER_ID": os.getenv("API_USER_ID"),
-    "API_KEY": os.getenv("API_KEY"),
-    "TARGET_ENVIRONMENT": os.getenv("TARGET_ENVIRONMENT"),
-    "MOMO_BASE_URL": os.getenv("MOMO_BASE_URL"),
-}
-
 #validate  config
+missing = settings.missing_momo_config()
+if missing:
+    raise Exception(f'Missing env variable: {", ".join(missing)}')
+if settings.momo_callback_url and not settings.momo_callback_secret:
+    # Unsigned callback URLs would let anyone mark a payment as paid
+    raise Exception('Missing env variable: MOMO_CALLBACK_SECRET (required with MOMO_CALLBACK_URL)')
+
+#Request latency histograms for /metrics
+app.add_middleware(metrics.MetricsMiddleware)
 
-for key ,value in CONFIG.items():
-    if not value and  key != 'TARGET_ENVIRONMENT':
-        raise Exception(f'Missing env variable: {key}')
-    
 app.include_router(routes.router)  
 
 
 if __name__ == "__main__":
+    # Development server; use serve.py for multiple workers
     import uvicorn
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
 
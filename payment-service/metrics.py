@@ -0,0 +1,191 @@
+"""Minimal in-process Prometheus metrics.
+
+Counters, gauges and histograms are plain dicts keyed by label values, so
+recording a sample is a dict lookup plus a bisect. render() produces the
+Prometheus text exposition format served on GET /metrics. Values are per
+process; with several workers, scrape each one or aggregate by instance.
+"""
+import time
+from bisect import bisect_left
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers fast DB commits up to slow upstream calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        _registry.append(self)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> list:
+        raise NotImplementedError
+
+
+class _Value(_Metric):
+    """Counter or gauge: either updated directly or read at scrape time from `function`.
+
+    `function` returns a number, or a {label_values: number} dict for labelled metrics.
+    """
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+        self.function = function
+
+    def _samples(self):
+        if self.function is not None:
+            value = self.function()
+            values = value if isinstance(value, dict) else {(): value}
+        else:
+            values = self._values
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values.items()]
+
+
+class Counter(_Value):
+    kind = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(_Value):
+    kind = "gauge"
+
+    def set(self, value: float, *label_values):
+        self._values[label_values] = value
+
+    def replace(self, values: dict):
+        """Swap in a full {label_values: value} mapping, dropping label sets that disappeared"""
+        self._values = dict(values)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, label_values: tuple):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Metrics recorded across the service
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time spent handling HTTP requests", ("method", "route", "status")
+)
+momo_request_duration = Histogram(
+    "momo_request_duration_seconds", "Time spent on calls to the Momo API", ("method", "endpoint", "status")
+)
+db_session_duration = Histogram(
+    "db_session_duration_seconds", "Lifetime of request-scoped database sessions"
+)
+db_commit_duration = Histogram(
+    "db_commit_duration_seconds", "Time spent flushing and committing database transactions"
+)
+token_cache_events = Counter(
+    "momo_token_cache_total", "Momo access token lookups by outcome", ("result",)
+)
+transactions_by_status = Gauge(
+    "payment_transactions", "Transactions in the database by status", ("status",)
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording http_request_duration_seconds by route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Unmatched paths share one label so random URLs can't blow up cardinality
+            path = getattr(route, "path", "<unmatched>")
+            http_request_duration.observe(time.perf_counter() - started, scope["method"], path, status_code[0])
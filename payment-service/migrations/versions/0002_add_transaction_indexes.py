@@ -0,0 +1,41 @@
+"""add transaction indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:10:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_transactions_external_id", "transactions", ["external_id"])
+    op.create_index("ix_transactions_status", "transactions", ["status"])
+    op.create_index("ix_transactions_created_at_id", "transactions", ["created_at", "id"])
+    # Only PENDING rows, in the order the reconciler walks them
+    op.create_index(
+        "ix_transactions_pending",
+        "transactions",
+        ["created_at", "id"],
+        postgresql_where=sa.text("status = 'PENDING'"),
+        sqlite_where=sa.text("status = 'PENDING'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_transactions_pending", table_name="transactions")
+    op.drop_index("ix_transactions_created_at_id", table_name="transactions")
+    op.drop_index("ix_transactions_status", table_name="transactions")
+    op.drop_index("ix_transactions_external_id", table_name="transactions")
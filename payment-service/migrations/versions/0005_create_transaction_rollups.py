@@ -0,0 +1,117 @@
+"""create transaction rollups
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 09:40:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, Sequence[str], None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Same statements as models.ROLLUP_TRIGGERS at the time of this revision
+TRIGGERS = {
+    "sqlite": [
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_insert
+        AFTER INSERT ON transactions
+        BEGIN
+            INSERT INTO transaction_rollup_deltas (day, currency, status, transaction_count, total_amount)
+            VALUES (date(NEW.created_at), COALESCE(NEW.currency, ''), COALESCE(NEW.status, ''), 1, NEW.amount);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_status
+        AFTER UPDATE OF status ON transactions
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            INSERT INTO transaction_rollup_deltas (day, currency, status, transaction_count, total_amount)
+            VALUES (date(OLD.created_at), COALESCE(OLD.currency, ''), COALESCE(OLD.status, ''), -1, -OLD.amount),
+                   (date(NEW.created_at), COALESCE(NEW.currency, ''), COALESCE(NEW.status, ''), 1, NEW.amount);
+        END
+        """,
+    ],
+    "postgresql": [
+        """
+        CREATE OR REPLACE FUNCTION transactions_rollup_delta() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'UPDATE' THEN
+                IF OLD.status IS NOT DISTINCT FROM NEW.status THEN
+                    RETURN NULL;
+                END IF;
+                INSERT INTO transaction_rollup_deltas (day, currency, status, transaction_count, total_amount)
+                VALUES (OLD.created_at::date, COALESCE(OLD.currency, ''), COALESCE(OLD.status, ''), -1, -OLD.amount);
+            END IF;
+            INSERT INTO transaction_rollup_deltas (day, currency, status, transaction_count, total_amount)
+            VALUES (NEW.created_at::date, COALESCE(NEW.currency, ''), COALESCE(NEW.status, ''), 1, NEW.amount);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS trg_transactions_rollup ON transactions",
+        """
+        CREATE TRIGGER trg_transactions_rollup
+        AFTER INSERT OR UPDATE OF status ON transactions
+        FOR EACH ROW EXECUTE FUNCTION transactions_rollup_delta()
+        """,
+    ],
+}
+
+DROP_TRIGGERS = {
+    "sqlite": [
+        "DROP TRIGGER IF EXISTS trg_transactions_rollup_status",
+        "DROP TRIGGER IF EXISTS trg_transactions_rollup_insert",
+    ],
+    "postgresql": [
+        "DROP TRIGGER IF EXISTS trg_transactions_rollup ON transactions",
+        "DROP FUNCTION IF EXISTS transactions_rollup_delta()",
+    ],
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "transaction_rollups",
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("currency", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("transaction_count", sa.Integer(), nullable=False),
+        sa.Column("total_amount", sa.Numeric(16, 2), nullable=False),
+        sa.PrimaryKeyConstraint("day", "currency", "status"),
+    )
+    op.create_table(
+        "transaction_rollup_deltas",
+        sa.Column("id", sa.BigInteger().with_variant(sa.Integer(), "sqlite"), autoincrement=True, nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("currency", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("transaction_count", sa.Integer(), nullable=False),
+        sa.Column("total_amount", sa.Numeric(16, 2), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+    # Backfill from existing transactions, then keep the rollups current with triggers
+    op.execute(
+        "INSERT INTO transaction_rollups (day, currency, status, transaction_count, total_amount) "
+        "SELECT date(created_at), COALESCE(currency, ''), COALESCE(status, ''), COUNT(*), SUM(amount) "
+        "FROM transactions GROUP BY date(created_at), COALESCE(currency, ''), COALESCE(status, '')"
+    )
+    for statement in TRIGGERS.get(op.get_bind().dialect.name, []):
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for statement in DROP_TRIGGERS.get(op.get_bind().dialect.name, []):
+        op.execute(statement)
+    op.drop_table("transaction_rollup_deltas")
+    op.drop_table("transaction_rollups")
@@ -0,0 +1,44 @@
+"""create transaction archive index
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 09:50:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, Sequence[str], None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "transaction_archive_index",
+        sa.Column("transaction_id", sa.String(), nullable=False),
+        sa.Column("external_id", sa.String(), nullable=False),
+        sa.Column("momo_reference_id", sa.String(), nullable=False),
+        sa.Column("archive_file", sa.String(), nullable=False),
+        sa.Column("block_offset", sa.BigInteger(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("archived_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("transaction_id"),
+    )
+    op.create_index("ix_transaction_archive_index_external_id", "transaction_archive_index", ["external_id"])
+    op.create_index(
+        "ix_transaction_archive_index_momo_reference_id", "transaction_archive_index", ["momo_reference_id"], unique=True
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_transaction_archive_index_momo_reference_id", table_name="transaction_archive_index")
+    op.drop_index("ix_transaction_archive_index_external_id", table_name="transaction_archive_index")
+    op.drop_table("transaction_archive_index")
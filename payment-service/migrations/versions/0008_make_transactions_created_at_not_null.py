@@ -0,0 +1,36 @@
+"""make transactions.created_at not null
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 10:30:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0008"
+down_revision: Union[str, Sequence[str], None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Keyset pagination and the rollups both need every row to have a creation time
+    op.execute(
+        "UPDATE transactions SET created_at = COALESCE(updated_at, CURRENT_TIMESTAMP) WHERE created_at IS NULL"
+    )
+    # SQLite can only change a column by rebuilding the table, which would drop
+    # the rollup triggers; there those triggers already reject a NULL created_at
+    if op.get_bind().dialect.name != "sqlite":
+        op.alter_column("transactions", "created_at", existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != "sqlite":
+        op.alter_column("transactions", "created_at", existing_type=sa.DateTime(), nullable=True)
@@ -1,5 +1,6 @@
+from typing import Any, List, Literal, Optional
 from pydantic import BaseModel, Field
-from sqlalchemy import Column, String, Numeric, DateTime, Text
+from sqlalchemy import BigInteger, Column, Date, DDL, String, Numeric, DateTime, Text, Integer, Index, event, text
 from database import Base
 import uuid
 from datetime import datetime
@@ -10,7 +11,7 @@ class PaymentRequest(BaseModel):
     currency: str = Field(default="EUR", description="Currency - GHS for production") 
     external_id: str = None
     payer_message: str = Field(default="Payment for services")
-    payee_note: str = Field(default="Thank you for your business"),
+    payee_note: str = Field(default="Thank you for your business")
     payer_phone_number: str = Field(..., description="Customer's phone number")  
 
     
@@ -26,27 +27,209 @@ class PaymentRequest(BaseModel):
             return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
         except phonenumbers.NumberParseException:
             raise ValueError("Invalid phone number format")'''
+class BulkPaymentRequest(BaseModel):
+    payments: List[PaymentRequest] = Field(..., min_length=1, max_length=10000, description="Payment requests to submit together")
+
 class PaymentStatusResponse(BaseModel):
     reference_id: str
     status: str
-    amount: str = None
-    currency: str = None
-    financial_transaction_id: str = None
+    amount: Optional[str] = None
+    currency: Optional[str] = None
+    financial_transaction_id: Optional[str] = None
+
+
+class TransactionOut(BaseModel):
+    """A transaction as returned by the API; with ?fields= only the requested fields are set"""
+    id: Optional[str] = None
+    momo_reference_id: Optional[str] = None
+    external_id: Optional[str] = None
+    amount: Optional[float] = None
+    currency: Optional[str] = None
+    payer_phone_number: Optional[str] = None
+    status: Optional[str] = None
+    financial_transaction_id: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    payer_message: Optional[str] = None
+    payee_note: Optional[str] = None
 
+class TransactionPage(BaseModel):
+    items: List[TransactionOut]
+    next_cursor: Optional[str] = None
+
+class MomoCallback(BaseModel):
+    """Body Momo sends to our X-Callback-Url once a request-to-pay settles"""
+    financialTransactionId: Optional[str] = None
+    externalId: Optional[str] = None
+    amount: Optional[str] = None
+    currency: Optional[str] = None
+    status: Literal["PENDING", "SUCCESSFUL", "FAILED"]
+    reason: Any = None
 
     
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        # Keyset pagination and time-range queries
+        Index("ix_transactions_created_at_id", "created_at", "id"),
+        # Partial index for the reconciler's scan of PENDING rows
+        Index(
+            "ix_transactions_pending",
+            "created_at",
+            "id",
+            postgresql_where=text("status = 'PENDING'"),
+            sqlite_where=text("status = 'PENDING'"),
+        ),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     momo_reference_id = Column(String, unique=True, nullable=False)
-    external_id = Column(String, nullable=False)
+    external_id = Column(String, nullable=False, index=True)
     amount = Column(Numeric(10, 2), nullable=False)
     currency = Column(String, default='GHS')
     payer_phone_number = Column(String, nullable=False)
-    status = Column(String, default='PENDING')
+    status = Column(String, default='PENDING', index=True)
     financial_transaction_id = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     payer_message = Column(Text)
-    payee_note = Column(Text)    
\ No newline at end of file
+    payee_note = Column(Text)
+
+
+class TransactionArchiveIndex(Base):
+    """Where an archived transaction lives: its file under ARCHIVE_DIR and the offset of its gzip block"""
+    __tablename__ = "transaction_archive_index"
+
+    transaction_id = Column(String, primary_key=True)
+    external_id = Column(String, nullable=False, index=True)
+    momo_reference_id = Column(String, nullable=False, unique=True, index=True)
+    archive_file = Column(String, nullable=False)
+    block_offset = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)
+    # Both stay NULL while the first request with this key is in flight
+    status_code = Column(Integer)
+    response_body = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class PaymentOutbox(Base):
+    """Request-to-pay waiting to be sent to Momo by the outbox dispatcher"""
+    __tablename__ = "payment_outbox"
+    __table_args__ = (
+        # Dispatcher claim scan: due rows still waiting to be sent
+        Index(
+            "ix_payment_outbox_due",
+            "next_attempt_at",
+            postgresql_where=text("state = 'PENDING'"),
+            sqlite_where=text("state = 'PENDING'"),
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    transaction_id = Column(String, nullable=False, index=True)
+    momo_reference_id = Column(String, nullable=False)
+    # PaymentRequest as JSON, replayed to request_to_pay
+    payload = Column(Text, nullable=False)
+    # PENDING until sent or given up on (SENT / FAILED)
+    state = Column(String, nullable=False, default='PENDING')
+    attempts = Column(Integer, nullable=False, default=0)
+    # Next send time; pushed forward by the claim lease and by retry backoff
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    claimed_by = Column(String)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class BackgroundLease(Base):
+    """Which worker process runs a background job (reconciler, archive) until expires_at"""
+    __tablename__ = "background_leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+class TransactionRollup(Base):
+    """Transaction count and amount per day, currency and status, for reporting"""
+    __tablename__ = "transaction_rollups"
+
+    day = Column(Date, primary_key=True)
+    currency = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)
+    transaction_count = Column(Integer, nullable=False, default=0)
+    total_amount = Column(Numeric(16, 2), nullable=False, default=0)
+
+class TransactionRollupDelta(Base):
+    """Change to a rollup, written by the transactions triggers and folded in by rollups.compact().
+
+    Triggers only ever append here, so concurrent payments never contend
+    for the same rollup row.
+    """
+    __tablename__ = "transaction_rollup_deltas"
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    day = Column(Date, nullable=False)
+    currency = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    transaction_count = Column(Integer, nullable=False)
+    total_amount = Column(Numeric(16, 2), nullable=False)
+
+# Every insert into transactions adds +1 to its (day, currency, status) rollup;
+# every status change moves it from the old status to the new one.
+# Kept in sync with migrations/versions/0005_create_transaction_rollups.py
+ROLLUP_TRIGGERS = {
+    "sqlite": [
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_insert
+        AFTER INSERT ON transactions
+        BEGIN
+            INSERT INTO transaction_rollup_deltas (day, currency, status, transaction_count, total_amount)
+            VALUES (date(NEW.created_at), COALESCE(NEW.currency, ''), COALESCE(NEW.status, ''), 1, NEW.amount);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_status
+        AFTER UPDATE OF status ON transactions
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            INSERT INTO transaction_rollup_deltas (day, currency, status, transaction_count, total_amount)
+            VALUES (date(OLD.created_at), COALESCE(OLD.currency, ''), COALESCE(OLD.status, ''), -1, -OLD.amount),
+                   (date(NEW.created_at), COALESCE(NEW.currency, ''), COALESCE(NEW.status, ''), 1, NEW.amount);
+        END
+        """,
+    ],
+    "postgresql": [
+        """
+        CREATE OR REPLACE FUNCTION transactions_rollup_delta() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'UPDATE' THEN
+                IF OLD.status IS NOT DISTINCT FROM NEW.status THEN
+                    RETURN NULL;
+                END IF;
+                INSERT INTO transaction_rollup_deltas (day, currency, status, transaction_count, total_amount)
+                VALUES (OLD.created_at::date, COALESCE(OLD.currency, ''), COALESCE(OLD.status, ''), -1, -OLD.amount);
+            END IF;
+            INSERT INTO transaction_rollup_deltas (day, currency, status, transaction_count, total_amount)
+            VALUES (NEW.created_at::date, COALESCE(NEW.currency, ''), COALESCE(NEW.status, ''), 1, NEW.amount);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS trg_transactions_rollup ON transactions",
+        """
+        CREATE TRIGGER trg_transactions_rollup
+        AFTER INSERT OR UPDATE OF status ON transactions
+        FOR EACH ROW EXECUTE FUNCTION transactions_rollup_delta()
+        """,
+    ],
+}
+
+# create_tables() (metadata.create_all) installs the triggers too; all statements are safe to re-run
+for _dialect, _statements in ROLLUP_TRIGGERS.items():
+    for _statement in _statements:
+        event.listen(Base.metadata, "after_create", DDL(_statement).execute_if(dialect=_dialect))
@@ -0,0 +1,153 @@
+import asyncio
+import re
+import time
+import httpx
+import metrics
+from settings import settings
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, AdaptiveLimiter, CircuitBreaker, UpstreamUnavailable
+
+# Timeouts in seconds for calls to the Momo API
+MOMO_CONNECT_TIMEOUT = settings.momo_connect_timeout
+MOMO_READ_TIMEOUT = settings.momo_read_timeout
+MOMO_POOL_TIMEOUT = settings.momo_pool_timeout
+MOMO_TOTAL_TIMEOUT = settings.momo_total_timeout
+
+# Connection pool limits, shared by every request in the process (a share of
+# MOMO_CONNECTION_BUDGET when several workers split one)
+MOMO_MAX_CONNECTIONS = settings.momo_connections()
+MOMO_MAX_KEEPALIVE = settings.momo_max_keepalive
+MOMO_KEEPALIVE_EXPIRY = settings.momo_keepalive_expiry
+
+# Circuit breaker around the Momo API
+MOMO_BREAKER_WINDOW = settings.momo_breaker_window
+MOMO_BREAKER_MIN_CALLS = settings.momo_breaker_min_calls
+MOMO_BREAKER_FAILURE_RATE = settings.momo_breaker_failure_rate
+MOMO_BREAKER_SLOW_CALL = settings.momo_breaker_slow_call
+MOMO_BREAKER_SLOW_RATE = settings.momo_breaker_slow_rate
+MOMO_BREAKER_OPEN_SECONDS = settings.momo_breaker_open_seconds
+MOMO_BREAKER_HALF_OPEN_CALLS = settings.momo_breaker_half_open_calls
+
+# Adaptive limit on concurrent Momo calls
+MOMO_LIMIT_INITIAL = settings.momo_limit_initial
+MOMO_LIMIT_MIN = settings.momo_limit_min
+MOMO_LIMIT_MAX = settings.momo_limit_max or MOMO_MAX_CONNECTIONS
+MOMO_LIMIT_LATENCY_TARGET = settings.momo_limit_latency_target
+
+breaker = CircuitBreaker(
+    window=MOMO_BREAKER_WINDOW,
+    min_calls=MOMO_BREAKER_MIN_CALLS,
+    failure_rate=MOMO_BREAKER_FAILURE_RATE,
+    slow_call_seconds=MOMO_BREAKER_SLOW_CALL,
+    slow_rate=MOMO_BREAKER_SLOW_RATE,
+    open_seconds=MOMO_BREAKER_OPEN_SECONDS,
+    half_open_calls=MOMO_BREAKER_HALF_OPEN_CALLS,
+)
+limiter = AdaptiveLimiter(
+    initial=MOMO_LIMIT_INITIAL,
+    min_limit=MOMO_LIMIT_MIN,
+    max_limit=MOMO_LIMIT_MAX,
+    latency_target=MOMO_LIMIT_LATENCY_TARGET,
+)
+
+_client = None
+
+# Reference ids in Momo paths are replaced so metrics keep one series per endpoint
+_ID_SEGMENT = re.compile(r"/[0-9a-fA-F-]{32,36}(?=/|$)")
+
+
+def _build_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=settings.momo_base_url or "",
+        timeout=httpx.Timeout(
+            MOMO_READ_TIMEOUT,
+            connect=MOMO_CONNECT_TIMEOUT,
+            pool=MOMO_POOL_TIMEOUT,
+        ),
+        limits=httpx.Limits(
+            max_connections=MOMO_MAX_CONNECTIONS,
+            max_keepalive_connections=MOMO_MAX_KEEPALIVE,
+            keepalive_expiry=MOMO_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+async def start_client():
+    """Open the shared Momo client, called on app startup"""
+    global _client
+    if _client is None:
+        _client = _build_client()
+
+
+async def close_client():
+    """Close the shared Momo client and its pooled connections, called on app shutdown"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it for callers outside the app (scripts)"""
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+
+def check_available():
+    """Raise UpstreamUnavailable (503) now if a Momo call would be refused"""
+    if breaker.state != CLOSED and breaker.retry_after() > 0:
+        raise UpstreamUnavailable("circuit open", breaker.retry_after())
+    if limiter.in_flight >= int(limiter.limit):
+        raise UpstreamUnavailable("too many requests in flight", 1)
+
+
+async def send(method: str, path: str, shed: bool = True, **kwargs) -> httpx.Response:
+    """Send a request to the Momo API, bounded by MOMO_TOTAL_TIMEOUT.
+
+    Goes through the adaptive limiter and the circuit breaker; either can
+    refuse the call with UpstreamUnavailable (503) without contacting Momo.
+    Background jobs pass shed=False to queue for a limiter slot instead.
+    """
+    endpoint = _ID_SEGMENT.sub("/{reference_id}", path)
+    await limiter.acquire(wait=not shed, timeout=MOMO_TOTAL_TIMEOUT)
+    try:
+        breaker.before_call()
+    except UpstreamUnavailable:
+        limiter.release()
+        raise
+
+    outcome = "error"
+    started = time.perf_counter()
+    try:
+        response = await asyncio.wait_for(get_client().request(method, path, **kwargs), MOMO_TOTAL_TIMEOUT)
+        outcome = response.status_code
+        return response
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        raise httpx.TimeoutException(f"Momo request {method} {path} exceeded {MOMO_TOTAL_TIMEOUT}s")
+    except httpx.HTTPError as e:
+        outcome = type(e).__name__
+        raise
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        metrics.momo_request_duration.observe(duration, method, endpoint, outcome)
+        if outcome == "cancelled":
+            # Says nothing about upstream health
+            limiter.release()
+            breaker.cancel_call()
+        else:
+            failed = not isinstance(outcome, int) or outcome >= 500 or outcome == 429
+            limiter.release(duration, failed)
+            breaker.record(duration, failed)
+
+
+_BREAKER_STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+metrics.Gauge("momo_circuit_state", "Momo circuit breaker state (0 closed, 1 half-open, 2 open)", function=lambda: _BREAKER_STATES[breaker.state])
+metrics.Counter("momo_circuit_opened_total", "Times the Momo circuit breaker opened", function=lambda: breaker.opened_total)
+metrics.Gauge("momo_concurrency_limit", "Current adaptive limit on concurrent Momo calls", function=lambda: int(limiter.limit))
+metrics.Gauge("momo_requests_in_flight", "Momo calls currently in flight", function=lambda: limiter.in_flight)
+metrics.Counter("momo_requests_shed_total", "Momo calls refused by the concurrency limit", function=lambda: limiter.rejected_total)
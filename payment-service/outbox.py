@@ -0,0 +1,290 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
+from models import PaymentOutbox, PaymentRequest
+from crud import apply_status_updates
+from utils import request_to_pay
+from circuit_breaker import UpstreamUnavailable
+import momo_client
+import metrics
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Asynchronous payment submission: the request handler only writes the
+# transaction and an outbox row, and the dispatcher sends them to Momo
+OUTBOX_ENABLED = settings.outbox_enabled
+OUTBOX_WORKERS = settings.outbox_workers
+OUTBOX_BATCH_SIZE = settings.outbox_batch_size
+# Momo sends in flight at once across all dispatcher workers in this process
+OUTBOX_CONCURRENCY = settings.outbox_concurrency
+OUTBOX_POLL_INTERVAL = settings.outbox_poll_interval
+# A claimed row becomes due again after this long, in case its worker died mid-send
+OUTBOX_LEASE_SECONDS = settings.outbox_lease_seconds
+OUTBOX_MAX_ATTEMPTS = settings.outbox_max_attempts
+OUTBOX_MIN_BACKOFF = settings.outbox_min_backoff
+OUTBOX_MAX_BACKOFF = settings.outbox_max_backoff
+
+_stats = {
+    "running": False,
+    "workers": 0,
+    "backlog": 0,
+    "oldest_pending_age_seconds": 0.0,
+    "last_batch_at": None,
+    "claimed_total": 0,
+    "sent_total": 0,
+    "retried_total": 0,
+    "deferred_total": 0,
+    "failed_total": 0,
+    "errors_total": 0,
+}
+_tasks = []
+_wakeup = None
+_stopping = False
+
+metrics.Counter("outbox_claimed_total", "Outbox rows claimed by the dispatcher", function=lambda: _stats["claimed_total"])
+metrics.Counter("outbox_sent_total", "Outbox rows accepted by Momo", function=lambda: _stats["sent_total"])
+metrics.Counter("outbox_retried_total", "Outbox sends scheduled for another attempt", function=lambda: _stats["retried_total"])
+metrics.Counter("outbox_deferred_total", "Outbox sends refused locally by the breaker or limiter, retried without using an attempt", function=lambda: _stats["deferred_total"])
+metrics.Counter("outbox_failed_total", "Outbox rows given up on", function=lambda: _stats["failed_total"])
+metrics.Counter("outbox_errors_total", "Failed dispatcher batches", function=lambda: _stats["errors_total"])
+metrics.Gauge("outbox_backlog", "Outbox rows waiting to be sent", function=lambda: _stats["backlog"])
+metrics.Gauge("outbox_oldest_pending_age_seconds", "Age of the oldest outbox row waiting to be sent", function=lambda: _stats["oldest_pending_age_seconds"])
+
+
+def get_stats() -> dict:
+    return dict(_stats)
+
+
+def entry(transaction_id: str, reference_id: str, payment_req: PaymentRequest, now: datetime = None) -> dict:
+    """Outbox row for a transaction, to insert in the same commit as the transaction"""
+    now = now or datetime.utcnow()
+    return {
+        "transaction_id": transaction_id,
+        "momo_reference_id": reference_id,
+        "payload": payment_req.model_dump_json(),
+        "state": "PENDING",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def notify():
+    """Wake the dispatcher after committing new outbox rows, instead of waiting for its next poll"""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds before the next try after `attempts` failed sends, doubling each time"""
+    return min(OUTBOX_MIN_BACKOFF * 2 ** (attempts - 1), OUTBOX_MAX_BACKOFF)
+
+
+async def claim(db: AsyncSession, worker: str, limit: int) -> list:
+    """Claim up to `limit` due outbox rows for `worker` and commit the claim.
+
+    On Postgres the due rows are picked with FOR UPDATE SKIP LOCKED, so
+    concurrent dispatchers (in this or other processes) claim disjoint
+    batches without waiting on each other. SQLite has no row locks and
+    drops the clause; there the UPDATE holds the database write lock from
+    the start, so the pick-and-claim is still atomic. Claiming pushes
+    next_attempt_at out by the lease, which is what hides the row from
+    other dispatchers until it is sent, rescheduled or the lease runs out.
+    """
+    now = datetime.utcnow()
+    due = (
+        select(PaymentOutbox.id)
+        .where(PaymentOutbox.state == "PENDING", PaymentOutbox.next_attempt_at <= now)
+        .order_by(PaymentOutbox.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(
+        update(PaymentOutbox)
+        .where(PaymentOutbox.id.in_(due.scalar_subquery()))
+        # Re-checked against the current row version under Postgres READ COMMITTED
+        .where(PaymentOutbox.state == "PENDING", PaymentOutbox.next_attempt_at <= now)
+        .values(
+            next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+            attempts=PaymentOutbox.attempts + 1,
+            claimed_by=worker,
+            updated_at=now,
+        )
+        .returning(
+            PaymentOutbox.id,
+            PaymentOutbox.transaction_id,
+            PaymentOutbox.momo_reference_id,
+            PaymentOutbox.payload,
+            PaymentOutbox.attempts,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    rows = result.all()
+    await db.commit()
+    return rows
+
+
+async def _send(row, semaphore: asyncio.Semaphore) -> tuple:
+    """Send one claimed row; returns (outbox values, new transaction status or None)"""
+    now = datetime.utcnow()
+    async with semaphore:
+        try:
+            payment_req = PaymentRequest.model_validate_json(row.payload)
+            response = await request_to_pay(row.momo_reference_id, payment_req, shed=False)
+        except UpstreamUnavailable as e:
+            # Refused before reaching Momo: try again once the breaker or limiter allows,
+            # handing back the attempt claim() counted so an outage can't use them all up
+            _stats["deferred_total"] += 1
+            return {
+                "id": row.id,
+                "attempts": row.attempts - 1,
+                "next_attempt_at": now + timedelta(seconds=e.retry_after),
+                "last_error": e.detail,
+                "updated_at": now,
+            }, None
+        except Exception as e:
+            # Token, network and breaker failures are all worth another try
+            error = f"Failed to initiate payment: {str(e)}"
+            response = None
+
+    if response is not None:
+        # A 409 on a retry means Momo kept an earlier attempt whose response we lost
+        if response.status_code == 202 or (response.status_code == 409 and row.attempts > 1):
+            return {"id": row.id, "state": "SENT", "last_error": None, "updated_at": now}, "PENDING"
+        error = f"MTN Momo API Error: {response.text}"
+        if response.status_code < 500 and response.status_code != 429:
+            # Momo rejected the request itself; resending won't help
+            return {"id": row.id, "state": "FAILED", "last_error": error, "updated_at": now}, "FAILED"
+
+    if row.attempts >= OUTBOX_MAX_ATTEMPTS:
+        return {"id": row.id, "state": "FAILED", "last_error": error, "updated_at": now}, "ERROR"
+    next_attempt_at = now + timedelta(seconds=retry_delay(row.attempts))
+    return {"id": row.id, "next_attempt_at": next_attempt_at, "last_error": error, "updated_at": now}, None
+
+
+async def dispatch_batch(worker: str, semaphore: asyncio.Semaphore) -> int:
+    """Claim one batch, send it to Momo and record the results; returns the batch size"""
+    async with AsyncSessionLocal() as db:
+        rows = await claim(db, worker, OUTBOX_BATCH_SIZE)
+    if not rows:
+        return 0
+    _stats["claimed_total"] += len(rows)
+
+    results = await asyncio.gather(*(_send(row, semaphore) for row in rows))
+
+    now = datetime.utcnow()
+    outbox_updates = []
+    status_updates = []
+    for row, (values, new_status) in zip(rows, results):
+        outbox_updates.append(values)
+        if new_status:
+            status_updates.append({
+                "id": row.transaction_id,
+                "momo_reference_id": row.momo_reference_id,
+                "status": new_status,
+                "updated_at": now,
+            })
+        if values.get("state") == "SENT":
+            _stats["sent_total"] += 1
+        elif values.get("state") == "FAILED":
+            _stats["failed_total"] += 1
+        elif "attempts" not in values:
+            # Deferred rows are counted in _send
+            _stats["retried_total"] += 1
+
+    async with AsyncSessionLocal() as db:
+        # Skip rows whose lease ran out and were claimed by another worker meanwhile
+        await db.execute(
+            update(PaymentOutbox).where(PaymentOutbox.claimed_by == worker),
+            outbox_updates,
+            execution_options={"synchronize_session": None},
+        )
+        if status_updates:
+            # Commits the outbox update along with the transaction statuses
+            await apply_status_updates(db, status_updates)
+        else:
+            await db.commit()
+    _stats["last_batch_at"] = datetime.utcnow().isoformat()
+    return len(rows)
+
+
+async def refresh_backlog(db: AsyncSession):
+    """Update the backlog gauges from the PENDING rows (served by ix_payment_outbox_due)"""
+    count, oldest = (await db.execute(
+        select(func.count(), func.min(PaymentOutbox.created_at)).where(PaymentOutbox.state == "PENDING")
+    )).one()
+    _stats["backlog"] = count
+    _stats["oldest_pending_age_seconds"] = round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else 0.0
+
+
+async def _sleep(timeout: float):
+    """Wait up to `timeout` seconds, or until notify() or stop()"""
+    try:
+        await asyncio.wait_for(_wakeup.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    _wakeup.clear()
+
+
+async def _run(worker: str, semaphore: asyncio.Semaphore):
+    while not _stopping:
+        retry_after = momo_client.breaker.retry_after()
+        if retry_after > 0:
+            # Momo is known to be down: leave the rows unclaimed until the breaker lets probes through
+            await _sleep(retry_after)
+            continue
+        try:
+            claimed = await dispatch_batch(worker, semaphore)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            _stats["errors_total"] += 1
+            logger.exception("Outbox batch for %s failed", worker)
+            claimed = 0
+        if claimed < OUTBOX_BATCH_SIZE and not _stopping:
+            # Drained: sleep until notify() or the next poll
+            await _sleep(OUTBOX_POLL_INTERVAL)
+
+
+def start():
+    """Start the dispatcher workers on the running event loop, if enabled"""
+    global _wakeup, _stopping
+    if OUTBOX_ENABLED and not _tasks:
+        _stopping = False
+        _wakeup = asyncio.Event()
+        semaphore = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        for index in range(OUTBOX_WORKERS):
+            _tasks.append(asyncio.create_task(_run(f"{prefix}:{index}", semaphore)))
+        _stats.update(running=True, workers=len(_tasks))
+
+
+async def stop(timeout: float = 0):
+    """Stop the dispatcher workers, first giving batches already claimed up to `timeout` seconds to finish.
+
+    Workers still busy after that are cancelled; their rows stay claimed and
+    are picked up again once the lease runs out.
+    """
+    global _wakeup, _stopping
+    _stopping = True
+    if _wakeup is not None:
+        _wakeup.set()
+    if _tasks and timeout > 0:
+        await asyncio.wait(_tasks, timeout=timeout)
+    for task in _tasks:
+        task.cancel()
+    for task in _tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _tasks.clear()
+    _wakeup = None
+    _stats.update(running=False, workers=0)
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import math
+import time
+import httpx
+from datetime import datetime
+from sqlalchemy import select, tuple_
+from database import AsyncSessionLocal
+from models import Transaction
+from crud import UNCONFIRMED_STATUSES, apply_status_updates, never_received, status_update_from_momo, status_update_not_received
+from utils import fetch_payment_status
+import leases
+import metrics
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Background polling of PENDING transactions, and of ERROR ones Momo may have received
+RECONCILER_ENABLED = settings.reconciler_enabled
+RECONCILE_INTERVAL = settings.reconcile_interval
+RECONCILE_BATCH_SIZE = settings.reconcile_batch_size
+RECONCILE_CONCURRENCY = settings.reconcile_concurrency
+# A transaction of age A is re-checked every ~A seconds, clamped to these bounds
+RECONCILE_MIN_BACKOFF = settings.reconcile_min_backoff
+RECONCILE_MAX_BACKOFF = settings.reconcile_max_backoff
+
+_stats = {
+    "running": False,
+    # Whether this worker holds the reconciler lease and does the sweeps
+    "leader": False,
+    "backlog": 0,
+    "oldest_pending_age_seconds": 0.0,
+    "max_overdue_seconds": 0.0,
+    "last_sweep_at": None,
+    "last_sweep_duration_seconds": 0.0,
+    "sweeps_total": 0,
+    "checked_total": 0,
+    "updated_total": 0,
+    "errors_total": 0,
+}
+# transaction id -> time.time() of our last Momo check, only for rows still unconfirmed
+_last_checked = {}
+_task = None
+
+metrics.Gauge("reconciler_backlog", "PENDING transactions seen in the last sweep", function=lambda: _stats["backlog"])
+metrics.Gauge("reconciler_oldest_pending_age_seconds", "Age of the oldest PENDING transaction", function=lambda: _stats["oldest_pending_age_seconds"])
+metrics.Gauge("reconciler_max_overdue_seconds", "Largest delay past a transaction's due check time", function=lambda: _stats["max_overdue_seconds"])
+metrics.Counter("reconciler_checks_total", "Momo status checks made by the reconciler", function=lambda: _stats["checked_total"])
+metrics.Counter("reconciler_updates_total", "Transactions the reconciler moved out of PENDING", function=lambda: _stats["updated_total"])
+metrics.Counter("reconciler_errors_total", "Failed reconciler checks and sweeps", function=lambda: _stats["errors_total"])
+
+
+def get_stats() -> dict:
+    return dict(_stats)
+
+
+def backoff_interval(age: float) -> float:
+    """Seconds to wait between checks of a transaction that is `age` seconds old.
+
+    The interval doubles each time the age doubles, so fresh payments are
+    polled often and stale ones rarely.
+    """
+    if age <= RECONCILE_MIN_BACKOFF:
+        return RECONCILE_MIN_BACKOFF
+    interval = RECONCILE_MIN_BACKOFF * 2 ** math.floor(math.log2(age / RECONCILE_MIN_BACKOFF))
+    return min(interval, RECONCILE_MAX_BACKOFF)
+
+
+async def _check(row, semaphore: asyncio.Semaphore):
+    """Row update for one PENDING or ERROR transaction from Momo, or None when nothing changed"""
+    async with semaphore:
+        try:
+            payment_data = await fetch_payment_status(row.momo_reference_id, shed=False)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404 and never_received(row.status, row.updated_at):
+                return status_update_not_received(row.id, row.momo_reference_id)
+            if e.response.status_code != 404 or row.status != "ERROR":
+                _stats["errors_total"] += 1
+                logger.exception("Reconcile check for %s failed", row.momo_reference_id)
+            return None
+        except Exception:
+            _stats["errors_total"] += 1
+            logger.exception("Reconcile check for %s failed", row.momo_reference_id)
+            return None
+        finally:
+            _stats["checked_total"] += 1
+            _last_checked[row.id] = time.time()
+    if payment_data.get("status") == row.status:
+        return None
+    return status_update_from_momo(row.id, row.momo_reference_id, payment_data)
+
+
+async def sweep(renew_lease: bool = False):
+    """Check every due PENDING or ERROR transaction once, batch by batch.
+
+    With renew_lease the reconciler lease is renewed between batches, and
+    the sweep stops if another worker has taken it over.
+    """
+    started = time.time()
+    semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+    now_utc = datetime.utcnow()
+    backlog = 0
+    oldest_age = 0.0
+    max_overdue = 0.0
+    seen = set()
+    cursor = None
+
+    while True:
+        query = (
+            select(Transaction.id, Transaction.momo_reference_id, Transaction.status, Transaction.created_at, Transaction.updated_at)
+            .where(Transaction.status.in_(UNCONFIRMED_STATUSES))
+            .order_by(Transaction.created_at, Transaction.id)
+            .limit(RECONCILE_BATCH_SIZE)
+        )
+        if cursor:
+            query = query.where(tuple_(Transaction.created_at, Transaction.id) > cursor)
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(query)).all()
+        if not rows:
+            break
+        cursor = (rows[-1].created_at, rows[-1].id)
+
+        due = []
+        for row in rows:
+            seen.add(row.id)
+            age = (now_utc - row.created_at).total_seconds()
+            oldest_age = max(oldest_age, age)
+            last_checked = _last_checked.get(row.id, time.time() - age)
+            overdue = time.time() - last_checked - backoff_interval(age)
+            if overdue >= 0:
+                due.append(row)
+                max_overdue = max(max_overdue, overdue)
+        backlog += len(rows)
+
+        results = await asyncio.gather(
+            *(_check(row, semaphore) for row in due)
+        )
+        updates = [update for update in results if update]
+        if updates:
+            async with AsyncSessionLocal() as db:
+                await apply_status_updates(db, updates)
+            _stats["updated_total"] += len(updates)
+
+        if len(rows) < RECONCILE_BATCH_SIZE:
+            break
+        if renew_lease and not await leases.acquire("reconciler", RECONCILE_INTERVAL):
+            # The new holder sweeps from the start; keep the previous sweep's stats
+            _stats["leader"] = False
+            logger.warning("Reconciler lease lost mid-sweep, stopping")
+            return
+
+    # Forget transactions that are no longer PENDING or ERROR
+    for transaction_id in list(_last_checked):
+        if transaction_id not in seen:
+            del _last_checked[transaction_id]
+
+    _stats.update(
+        backlog=backlog,
+        oldest_pending_age_seconds=round(oldest_age, 3),
+        max_overdue_seconds=round(max_overdue, 3),
+        last_sweep_at=datetime.utcnow().isoformat(),
+        last_sweep_duration_seconds=round(time.time() - started, 3),
+        sweeps_total=_stats["sweeps_total"] + 1,
+    )
+
+
+async def _run():
+    while True:
+        try:
+            # One worker sweeps for the whole deployment; the others stand by
+            _stats["leader"] = await leases.acquire("reconciler", RECONCILE_INTERVAL)
+            if _stats["leader"]:
+                await sweep(renew_lease=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            _stats["errors_total"] += 1
+            logger.exception("Reconcile sweep failed")
+        await asyncio.sleep(RECONCILE_INTERVAL)
+
+
+def start():
+    """Start the reconciliation loop on the running event loop, if enabled"""
+    global _task
+    if RECONCILER_ENABLED and _task is None:
+        _task = asyncio.create_task(_run())
+        _stats["running"] = True
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+        if _stats["leader"]:
+            await leases.release("reconciler")
+        _stats.update(running=False, leader=False)
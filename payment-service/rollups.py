@@ -0,0 +1,231 @@
+"""Transaction rollups for reporting.
+
+Triggers on `transactions` (see models.ROLLUP_TRIGGERS) append a delta row
+for every insert and status change. compact() folds the deltas into
+`transaction_rollups` in the background, and report() reads the rollups
+plus any deltas not folded in yet, so dashboard queries touch a few rows
+per day instead of every transaction.
+
+    python rollups.py rebuild    # recompute all rollups from transactions and the archive (backfill)
+"""
+import argparse
+import asyncio
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from sqlalchemy import delete, func, insert, literal_column, select, text, union_all
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
+from models import Transaction, TransactionArchiveIndex, TransactionRollup, TransactionRollupDelta
+import archive
+import metrics
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COMPACT_INTERVAL = settings.rollup_compact_interval
+ROLLUP_COMPACT_BATCH = settings.rollup_compact_batch
+
+GROUP_COLUMNS = ("day", "currency", "status")
+
+_UPSERTS = {"postgresql": postgresql_insert, "sqlite": sqlite_insert}
+
+_stats = {
+    "running": False,
+    "last_compact_at": None,
+    "compacted_total": 0,
+    "errors_total": 0,
+}
+_task = None
+
+metrics.Counter("rollup_deltas_compacted_total", "Rollup deltas folded into transaction_rollups", function=lambda: _stats["compacted_total"])
+metrics.Counter("rollup_compact_errors_total", "Failed rollup compactions", function=lambda: _stats["errors_total"])
+
+
+def get_stats() -> dict:
+    return dict(_stats)
+
+
+async def compact(db: AsyncSession) -> int:
+    """Fold up to ROLLUP_COMPACT_BATCH deltas into the rollups; returns how many were folded.
+
+    The deltas are deleted and applied in one transaction. DELETE ...
+    RETURNING hands each delta to exactly one compactor, even with several
+    workers compacting at once.
+    """
+    oldest = select(TransactionRollupDelta.id).order_by(TransactionRollupDelta.id).limit(ROLLUP_COMPACT_BATCH)
+    result = await db.execute(
+        delete(TransactionRollupDelta)
+        .where(TransactionRollupDelta.id.in_(oldest.scalar_subquery()))
+        .returning(
+            TransactionRollupDelta.day,
+            TransactionRollupDelta.currency,
+            TransactionRollupDelta.status,
+            TransactionRollupDelta.transaction_count,
+            TransactionRollupDelta.total_amount,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    deltas = result.all()
+    if not deltas:
+        await db.rollback()
+        return 0
+
+    totals = {}
+    for day, currency, status, count, amount in deltas:
+        total = totals.setdefault((day, currency, status), [0, Decimal(0)])
+        total[0] += count
+        total[1] += Decimal(str(amount))
+
+    upsert = _UPSERTS[db.bind.dialect.name](TransactionRollup)
+    # Sorted keys keep concurrent compactors locking rollup rows in the same order
+    await db.execute(
+        upsert.on_conflict_do_update(
+            index_elements=list(GROUP_COLUMNS),
+            set_={
+                "transaction_count": TransactionRollup.transaction_count + upsert.excluded.transaction_count,
+                "total_amount": TransactionRollup.total_amount + upsert.excluded.total_amount,
+            },
+        ),
+        [
+            {"day": day, "currency": currency, "status": status, "transaction_count": count, "total_amount": amount}
+            for (day, currency, status), (count, amount) in sorted(totals.items())
+        ],
+    )
+    await db.commit()
+    return len(deltas)
+
+
+async def report(db: AsyncSession, group_by: tuple = GROUP_COLUMNS, date_from: date = None,
+                 date_to: date = None, currency: str = None, status: str = None) -> list:
+    """Transaction count and amount grouped by any of day, currency and status"""
+    parts = []
+    for table in (TransactionRollup, TransactionRollupDelta):
+        parts.append(select(
+            table.day, table.currency, table.status,
+            table.transaction_count.label("transaction_count"),
+            table.total_amount.label("total_amount"),
+        ))
+    rows = union_all(*parts).subquery()
+
+    filters = []
+    if date_from:
+        filters.append(rows.c.day >= date_from)
+    if date_to:
+        filters.append(rows.c.day <= date_to)
+    if currency:
+        filters.append(rows.c.currency == currency)
+    if status:
+        filters.append(rows.c.status == status)
+
+    keys = [rows.c[column] for column in group_by]
+    count = func.sum(rows.c.transaction_count)
+    query = (
+        select(*keys, count.label("count"), func.sum(rows.c.total_amount).label("amount"))
+        .where(*filters)
+        .group_by(*keys)
+        # Statuses every transaction of the group has since moved out of
+        .having(count != 0)
+        .order_by(*keys)
+    )
+    result = await db.execute(query)
+    return [
+        {
+            **{column: row._mapping[column] for column in group_by},
+            "count": row.count,
+            "amount": str(Decimal(str(row.amount)).quantize(Decimal("0.01"))),
+        }
+        for row in result.all()
+    ]
+
+
+def rebuild(engine) -> int:
+    """Recompute every rollup from the transactions table and the archive; returns the number of rollup rows.
+
+    Runs in one transaction. On Postgres, writes to transactions are
+    blocked meanwhile so no delta is lost or counted twice; SQLite's write
+    lock does the same.
+    """
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("LOCK TABLE transactions, transaction_archive_index IN SHARE ROW EXCLUSIVE MODE"))
+        conn.execute(delete(TransactionRollupDelta))
+        conn.execute(delete(TransactionRollup))
+
+        totals = {}
+
+        def add(day, currency, status, count, amount):
+            if not isinstance(day, date):
+                day = date.fromisoformat(str(day)[:10])
+            total = totals.setdefault((day, currency or "", status or ""), [0, Decimal(0)])
+            total[0] += count
+            total[1] += Decimal(str(amount))
+
+        day = func.date(Transaction.created_at)
+        currency = func.coalesce(Transaction.currency, literal_column("''"))
+        status = func.coalesce(Transaction.status, literal_column("''"))
+        grouped = select(day, currency, status, func.count(), func.sum(Transaction.amount)).group_by(day, currency, status)
+        for row in conn.execute(grouped):
+            add(*row)
+        # Archived transactions left the table but still count
+        files = conn.execute(select(TransactionArchiveIndex.archive_file).distinct()).scalars().all()
+        for row in archive.iter_archived(files):
+            add(row["created_at"], row["currency"], row["status"], 1, row["amount"])
+
+        if totals:
+            conn.execute(insert(TransactionRollup), [
+                {"day": day, "currency": currency, "status": status, "transaction_count": count, "total_amount": amount}
+                for (day, currency, status), (count, amount) in totals.items()
+            ])
+        return len(totals)
+
+
+async def _run():
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                compacted = await compact(db)
+            _stats["compacted_total"] += compacted
+            _stats["last_compact_at"] = datetime.utcnow().isoformat()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            _stats["errors_total"] += 1
+            compacted = 0
+            logger.exception("Rollup compaction failed")
+        # Keep going straight away while there is a backlog of deltas
+        if compacted < ROLLUP_COMPACT_BATCH:
+            await asyncio.sleep(ROLLUP_COMPACT_INTERVAL)
+
+
+def start():
+    """Start the compaction loop on the running event loop"""
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_run())
+        _stats["running"] = True
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+        _stats["running"] = False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["rebuild"])
+    args = parser.parse_args()
+
+    from database import engine
+
+    rows = rebuild(engine)
+    print(f"Rebuilt {rows} rollup rows from transactions")
@@ -1,27 +1,40 @@
 from fastapi import BackgroundTasks, HTTPException, status,APIRouter
-import requests
+import httpx
 import uuid
-import os
-from dotenv import load_dotenv
-from utils import get_momo_token
-from models import PaymentRequest,PaymentStatusResponse
+from utils import fetch_payment_status, request_to_pay, verify_callback_token, token_manager
+import momo_client
+from models import PaymentRequest,BulkPaymentRequest,PaymentStatusResponse,MomoCallback,TransactionOut,TransactionPage
 
-from sqlalchemy.orm import Session
-from database import get_db
-from models import Transaction
-from fastapi import Depends
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, AsyncSessionLocal
+from models import Transaction, PaymentOutbox
+from crud import apply_status_updates, status_update_from_momo, update_status_by_reference
+from crud import UNCONFIRMED_STATUSES, never_received, status_update_not_received
+from crud import transaction_filters, encode_cursor, decode_cursor, after_cursor, parse_fields
+from cache import LRUCache
+from datetime import date, datetime
+import reconciler
+import outbox
+import rollups
+import archive
+from status_cache import status_cache
+from fastapi import Depends, Header, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import time
+import metrics
+from settings import settings
+from typing import Optional
+import idempotency
+import asyncio
+import csv
+import io
+import json
 
 router = APIRouter(tags=['Routers'])
-load_dotenv()
 
-# Configuration from environment
-CONFIG = {
-    "SUBSCRIPTION_PRIMARY_KEY": os.getenv("SUBSCRIPTION_PRIMARY_KEY"),
-    "API_USER_ID": os.getenv("API_USER_ID"),
-    "API_KEY": os.getenv("API_KEY"),
-    "TARGET_ENVIRONMENT": os.getenv("TARGET_ENVIRONMENT"),
-    "MOMO_BASE_URL": os.getenv("MOMO_BASE_URL"),
-}
+# (reference_id, status) pairs already applied from callbacks, so Momo's retries are acked without a DB write
+_seen_callbacks = LRUCache(maxsize=100000, ttl=3600)
 
 # API Routes
 @router.get("/")
@@ -30,25 +43,118 @@ async def root():
 
 @router.get("/health")
 async def health_check():
-    """Check if API and Momo service are healthy"""
-    try:
-        token = get_momo_token()
-        return {
-            "status": "healthy",
-            "api": "running",
-            "momo_api": "accessible"
-        }
-    except Exception as e:
-        raise HTTPException(
-            status_code=503,
-            detail=f"Service unhealthy: {str(e)}"
-        )
+    """Check if API and Momo service are healthy, from local state only (no Momo call per probe)"""
+    breaker = momo_client.breaker.stats()
+    body = {
+        "status": "healthy" if breaker["state"] != "open" else "degraded",
+        "api": "running",
+        "momo_api": "accessible" if breaker["state"] == "closed" else breaker["state"],
+        "circuit_breaker": breaker,
+        "concurrency": momo_client.limiter.stats(),
+        "token": token_manager.state(),
+    }
+    if breaker["state"] == "open":
+        return JSONResponse(status_code=503, content=body)
+    return body
 
 @router.post("/payment/request", response_model=dict, status_code=status.HTTP_202_ACCEPTED)
-async def request_payment(payment_req: PaymentRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def request_payment(
+    payment_req: PaymentRequest,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None),
+):
     """
-    Momo payment request
+    Momo payment request. Repeats with the same Idempotency-Key header (or
+    external_id) get the original response back instead of a second charge.
     """
+    # Async mode (OUTBOX_ENABLED): queue for the outbox dispatcher instead of calling Momo inline
+    submit = _enqueue_payment if outbox.OUTBOX_ENABLED else _submit_payment
+    key = idempotency.resolve_key(idempotency_key, payment_req.external_id)
+    if not key:
+        return await submit(payment_req, db)
+
+    request_hash = idempotency.request_hash(payment_req)
+    stored = await idempotency.begin(db, key, request_hash)
+    if stored:
+        status_code, body = stored
+        return JSONResponse(status_code=status_code, content=body, headers={"Idempotent-Replayed": "true"})
+
+    try:
+        result = await submit(payment_req, db)
+    except HTTPException as e:
+        if idempotency.is_final(e.status_code) or isinstance(e, PaymentOutcomeUnknown):
+            # Momo rejected the request, or may have taken it: replay the answer rather than charging again
+            await idempotency.complete(db, key, request_hash, e.status_code, {"detail": e.detail})
+        else:
+            await idempotency.release(db, key)
+        raise
+    await idempotency.complete(db, key, request_hash, status.HTTP_202_ACCEPTED, result)
+    return result
+
+async def _enqueue_payment(payment_req: PaymentRequest, db: AsyncSession) -> dict:
+    """Write the transaction and its outbox row in one commit; the dispatcher sends it to Momo"""
+    if not payment_req.external_id:
+        payment_req.external_id = str(uuid.uuid4())
+    try:
+        amount = float(payment_req.amount)
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Invalid amount: {payment_req.amount}")
+
+    reference_id = str(uuid.uuid4())
+    transaction = Transaction(
+        id=str(uuid.uuid4()),
+        momo_reference_id=reference_id,
+        external_id=payment_req.external_id,
+        amount=amount,
+        currency=payment_req.currency,
+        payer_phone_number=payment_req.payer_phone_number,
+        payer_message=payment_req.payer_message,
+        payee_note=payment_req.payee_note,
+        status='INITIATED'
+    )
+    db.add(transaction)
+    db.add(PaymentOutbox(**outbox.entry(transaction.id, reference_id, payment_req)))
+    await db.commit()
+    outbox.notify()
+
+    return {
+        "message": "Payment request queued",
+        "reference_id": reference_id,
+        "external_id": payment_req.external_id,
+        "status": "INITIATED",
+        "amount": payment_req.amount,
+        "currency": payment_req.currency
+    }
+
+class PaymentOutcomeUnknown(HTTPException):
+    """Momo may have received the request-to-pay, but its answer was lost or was a server error.
+
+    The transaction is left in ERROR for the reconciler (or the next status
+    check) to settle from Momo, and the idempotency key replays this
+    response instead of letting a retry send a second request-to-pay.
+    """
+
+    def __init__(self, status_code: int, message: str, reference_id: str, external_id: str):
+        super().__init__(
+            status_code=status_code,
+            detail={
+                "message": message,
+                "reference_id": reference_id,
+                "external_id": external_id,
+                "status": "ERROR",
+            },
+        )
+
+# Failures that prove the request-to-pay never left this process
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+async def _submit_payment(payment_req: PaymentRequest, db: AsyncSession) -> dict:
+    """Create the transaction row and send the request-to-pay to Momo"""
+    # Shed load before writing anything when Momo is known to be unavailable
+    momo_client.check_available()
+    # Set once Momo may have the request; from then on a failure must not lead to a second request-to-pay
+    sent = False
     try:
         # Generate reference ID if not provided
         if not payment_req.external_id:
@@ -69,45 +175,24 @@ async def request_payment(payment_req: PaymentRequest, background_tasks: Backgro
             status='INITIATED'
         )
         db.add(transaction)
-        db.commit()
-        db.refresh(transaction)
-        
-        # Get access token
-        access_token = get_momo_token()
-        
-        # Prepare request to Momo API
-        url = f"{CONFIG['MOMO_BASE_URL']}/collection/v1_0/requesttopay"
-        
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "X-Reference-Id": reference_id,
-            "X-Target-Environment": CONFIG["TARGET_ENVIRONMENT"],
-            "Content-Type": "application/json",
-            "Ocp-Apim-Subscription-Key": CONFIG["SUBSCRIPTION_PRIMARY_KEY"],
-        }
-        
-        # Create payload - use dynamic phone number for production, test number for sandbox
-        payer_phone = '233454567898' if CONFIG["TARGET_ENVIRONMENT"] == "sandbox" else payment_req.payer_phone_number
-        
-        payload = {
-            "amount": payment_req.amount,
-            "currency": payment_req.currency,
-            "externalId": payment_req.external_id,
-            "payer": {
-                "partyIdType": "MSISDN",
-                "partyId": payer_phone
-            },
-            "payerMessage": payment_req.payer_message,
-            "payeeNote": payment_req.payee_note
-        }
+        await db.commit()
         
         # Make API call
-        response = requests.post(url, json=payload, headers=headers)
+        try:
+            response = await request_to_pay(reference_id, payment_req)
+        except httpx.HTTPError as e:
+            sent = not isinstance(e, NOT_SENT_ERRORS)
+            raise
+        sent = True
         
         if response.status_code == 202:
-            # ✅ UPDATE TRANSACTION STATUS TO PENDING
-            transaction.status = 'PENDING'
-            db.commit()
+            # ✅ UPDATE TRANSACTION STATUS TO PENDING (unless a callback already finalised it)
+            await apply_status_updates(db, [{
+                "id": transaction.id,
+                "momo_reference_id": reference_id,
+                "status": "PENDING",
+                "updated_at": datetime.utcnow(),
+            }])
             
             return {
                 "message": "Payment request initiated successfully",
@@ -117,21 +202,40 @@ async def request_payment(payment_req: PaymentRequest, background_tasks: Backgro
                 "amount": payment_req.amount,
                 "currency": payment_req.currency
             }
+        elif response.status_code >= 500:
+            # Momo failed while handling it and may still have taken the payment
+            transaction.status = 'ERROR'
+            await db.commit()
+            raise PaymentOutcomeUnknown(
+                response.status_code,
+                f"MTN Momo API Error: {response.text}",
+                reference_id,
+                payment_req.external_id,
+            )
         else:
-            # ✅ UPDATE TRANSACTION STATUS TO FAILED
-            transaction.status = 'FAILED'
-            db.commit()
+            # ✅ UPDATE TRANSACTION STATUS TO FAILED (ERROR when a retry may still succeed)
+            transaction.status = 'FAILED' if idempotency.is_final(response.status_code) else 'ERROR'
+            await db.commit()
             
             raise HTTPException(
                 status_code=response.status_code,
                 detail=f"MTN Momo API Error: {response.text}"
             )
             
-    except requests.exceptions.RequestException as e:
+    except HTTPException:
+        # Never reached Momo (token failure, breaker open, limiter full)
+        if 'transaction' in locals() and transaction.status == 'INITIATED':
+            transaction.status = 'ERROR'
+            await db.commit()
+        raise
+    except httpx.HTTPError as e:
         # ✅ UPDATE TRANSACTION STATUS TO ERROR ON EXCEPTION
         if 'transaction' in locals():
             transaction.status = 'ERROR'
-            db.commit()
+            await db.commit()
+        if sent:
+            # Timed out or lost the connection after sending: the outcome is Momo's to tell
+            raise PaymentOutcomeUnknown(500, f"Failed to initiate payment: {str(e)}", reference_id, payment_req.external_id)
             
         raise HTTPException(
             status_code=500,
@@ -140,59 +244,185 @@ async def request_payment(payment_req: PaymentRequest, background_tasks: Backgro
     except Exception as e:
         # ✅ CATCH ANY OTHER EXCEPTIONS
         if 'transaction' in locals():
+            await db.rollback()
             transaction.status = 'ERROR'
-            db.commit()
+            await db.commit()
+        if sent:
+            raise PaymentOutcomeUnknown(500, f"Unexpected error: {str(e)}", reference_id, payment_req.external_id)
         raise HTTPException(
             status_code=500,
             detail=f"Unexpected error: {str(e)}"
         )
 
+# Upstream requests in flight at once for a single bulk call
+BULK_CONCURRENCY = settings.bulk_concurrency
+
+@router.post("/payment/request/bulk", status_code=status.HTTP_202_ACCEPTED)
+async def request_payment_bulk(bulk_req: BulkPaymentRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Submit many Momo payment requests at once: one bulk insert, a bounded
+    concurrent fan-out to Momo, then one bulk status update. With
+    OUTBOX_ENABLED the rows are queued for the outbox dispatcher instead.
+    """
+    if not outbox.OUTBOX_ENABLED:
+        momo_client.check_available()
+    now = datetime.utcnow()
+    rows = []
+    for index, payment_req in enumerate(bulk_req.payments):
+        if not payment_req.external_id:
+            payment_req.external_id = str(uuid.uuid4())
+        try:
+            amount = float(payment_req.amount)
+        except ValueError:
+            raise HTTPException(status_code=422, detail=f"Invalid amount for payment {index}: {payment_req.amount}")
+        rows.append({
+            "id": str(uuid.uuid4()),
+            "momo_reference_id": str(uuid.uuid4()),
+            "external_id": payment_req.external_id,
+            "amount": amount,
+            "currency": payment_req.currency,
+            "payer_phone_number": payment_req.payer_phone_number,
+            "payer_message": payment_req.payer_message,
+            "payee_note": payment_req.payee_note,
+            "status": "INITIATED",
+            "created_at": now,
+            "updated_at": now,
+        })
+    await db.execute(insert(Transaction), rows)
+    if outbox.OUTBOX_ENABLED:
+        await db.execute(insert(PaymentOutbox), [
+            outbox.entry(row["id"], row["momo_reference_id"], payment_req, now)
+            for row, payment_req in zip(rows, bulk_req.payments)
+        ])
+        await db.commit()
+        outbox.notify()
+        return {
+            "total": len(rows),
+            "queued": len(rows),
+            "results": [
+                {
+                    "reference_id": row["momo_reference_id"],
+                    "external_id": row["external_id"],
+                    "status": "INITIATED",
+                    "amount": payment_req.amount,
+                    "currency": payment_req.currency,
+                }
+                for row, payment_req in zip(rows, bulk_req.payments)
+            ],
+        }
+    await db.commit()
+
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def submit(row: dict, payment_req: PaymentRequest) -> tuple:
+        async with semaphore:
+            try:
+                response = await request_to_pay(row["momo_reference_id"], payment_req, shed=False)
+            except Exception as e:
+                return "ERROR", f"Failed to initiate payment: {str(e)}"
+        if response.status_code == 202:
+            return "PENDING", None
+        # Same rule as the single request: only a final rejection is FAILED
+        new_status = "FAILED" if idempotency.is_final(response.status_code) else "ERROR"
+        return new_status, f"MTN Momo API Error: {response.text}"
+
+    outcomes = await asyncio.gather(*(submit(row, payment_req) for row, payment_req in zip(rows, bulk_req.payments)))
+
+    updated_at = datetime.utcnow()
+    await apply_status_updates(db, [
+        {"id": row["id"], "momo_reference_id": row["momo_reference_id"], "status": new_status, "updated_at": updated_at}
+        for row, (new_status, _) in zip(rows, outcomes)
+    ])
+
+    results = []
+    for row, payment_req, (new_status, error) in zip(rows, bulk_req.payments, outcomes):
+        result = {
+            "reference_id": row["momo_reference_id"],
+            "external_id": row["external_id"],
+            "status": new_status,
+            "amount": payment_req.amount,
+            "currency": payment_req.currency,
+        }
+        if error:
+            result["error"] = error
+        results.append(result)
+
+    return {
+        "total": len(results),
+        "pending": sum(1 for new_status, _ in outcomes if new_status == "PENDING"),
+        "failed": sum(1 for new_status, _ in outcomes if new_status == "FAILED"),
+        # Not confirmed either way; the reconciler settles these from Momo
+        "error": sum(1 for new_status, _ in outcomes if new_status == "ERROR"),
+        "results": results,
+    }
+
 @router.get("/payment/status/{reference_id}", response_model=PaymentStatusResponse)
-async def get_payment_status(reference_id: str, db: Session = Depends(get_db)):
+async def get_payment_status(reference_id: str):
     """
-    Check the status of a payment request
+    Check the status of a payment request (served from the status cache when possible)
     """
+    return await status_cache.get(reference_id, lambda: _load_payment_status(reference_id))
+
+async def _load_payment_status(reference_id: str) -> PaymentStatusResponse:
+    async with AsyncSessionLocal() as db:
+        return await _read_payment_status(reference_id, db)
+
+async def _read_payment_status(reference_id: str, db: AsyncSession) -> PaymentStatusResponse:
     try:
         # ✅ FIRST CHECK DATABASE FOR TRANSACTION
-        transaction = db.query(Transaction).filter(
-            Transaction.momo_reference_id == reference_id
-        ).first()
+        result = await db.execute(
+            select(Transaction).where(Transaction.momo_reference_id == reference_id)
+        )
+        transaction = result.scalars().first()
         
         if not transaction:
-            raise HTTPException(status_code=404, detail="Transaction not found")
+            # Settled transactions move to the archive after ARCHIVE_AFTER_DAYS
+            archived = await archive.lookup(db, reference_id=reference_id)
+            if not archived:
+                raise HTTPException(status_code=404, detail="Transaction not found")
+            return PaymentStatusResponse(
+                reference_id=reference_id,
+                status=archived["status"],
+                amount=archived["amount"],
+                currency=archived["currency"],
+                financial_transaction_id=archived["financial_transaction_id"]
+            )
         
-        # If status is still PENDING, check with MTN API
-        if transaction.status == 'PENDING':
-            access_token = get_momo_token()
-            
-            url = f"{CONFIG['MOMO_BASE_URL']}/collection/v1_0/requesttopay/{reference_id}"
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "X-Target-Environment": CONFIG["TARGET_ENVIRONMENT"],
-                "Ocp-Apim-Subscription-Key": CONFIG["SUBSCRIPTION_PRIMARY_KEY"],
-            }
-            
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            
-            payment_data = response.json()
-            new_status = payment_data.get("status", "UNKNOWN")
+        # If status is still PENDING (or ERROR, which Momo may have received), check with MTN API
+        # (skipped when the reconciler keeps these rows up to date in the background)
+        if transaction.status in UNCONFIRMED_STATUSES and not reconciler.RECONCILER_ENABLED:
+            try:
+                payment_data = await fetch_payment_status(reference_id)
+                status_update = status_update_from_momo(transaction.id, reference_id, payment_data)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 404 or transaction.status != 'ERROR':
+                    raise
+                # Unknown to Momo: failed if it never arrived, else it may still be on its way
+                if never_received(transaction.status, transaction.updated_at):
+                    status_update = status_update_not_received(transaction.id, reference_id)
+                else:
+                    status_update = {"status": transaction.status, "financial_transaction_id": None}
             
             # ✅ UPDATE DATABASE WITH LATEST STATUS
-            transaction.status = new_status
-            if new_status == 'SUCCESSFUL':
-                transaction.financial_transaction_id = payment_data.get("financialTransactionId")
-            db.commit()
+            # Nothing to write while Momo reports the stored status; the write would also
+            # invalidate this very load and keep the result out of the status cache
+            if status_update["status"] != transaction.status:
+                await apply_status_updates(db, [status_update])
+            current_status = status_update["status"]
+            financial_transaction_id = status_update["financial_transaction_id"]
+        else:
+            current_status = transaction.status
+            financial_transaction_id = transaction.financial_transaction_id
         
         return PaymentStatusResponse(
             reference_id=reference_id,
-            status=transaction.status,
+            status=current_status,
             amount=str(transaction.amount),
             currency=transaction.currency,
-            financial_transaction_id=transaction.financial_transaction_id
+            financial_transaction_id=financial_transaction_id
         )
         
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         if e.response.status_code == 404:
             raise HTTPException(status_code=404, detail="Payment transaction not found")
         else:
@@ -201,30 +431,206 @@ async def get_payment_status(reference_id: str, db: Session = Depends(get_db)):
                 detail=f"Error fetching payment status: {str(e)}"
             )
 
-@router.get("/transactions")
-async def list_transactions(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """✅ NEW ENDPOINT: List all transactions"""
-    transactions = db.query(Transaction).offset(skip).limit(limit).all()
-    return transactions
+@router.api_route("/payment/callback/{reference_id}", methods=["POST", "PUT"])
+async def momo_callback(reference_id: str, callback: MomoCallback, token: str = None, db: AsyncSession = Depends(get_async_db)):
+    """
+    Receive the final status of a payment request from Momo
+    """
+    if not verify_callback_token(reference_id, token):
+        raise HTTPException(status_code=403, detail="Invalid callback signature")
+
+    key = (reference_id, callback.status)
+    if callback.status == "PENDING" or key in _seen_callbacks:
+        return {"reference_id": reference_id, "status": callback.status, "updated": False}
+
+    # Guarded update: repeated or late callbacks never change a final status
+    updated = await update_status_by_reference(
+        db,
+        reference_id,
+        {
+            "status": callback.status,
+            "financial_transaction_id": callback.financialTransactionId if callback.status == "SUCCESSFUL" else None,
+            "updated_at": datetime.utcnow(),
+        },
+        external_id=callback.externalId,
+    )
+    _seen_callbacks.set(key, True)
+    return {"reference_id": reference_id, "status": callback.status, "updated": updated}
+
+FIELDS_QUERY = Query(None, description="Comma-separated columns to return, e.g. id,status,amount (default: all)")
+
+# Rows are read as plain column tuples and returned as dicts: FastAPI validates and
+# serializes them against the response model in pydantic-core, with no ORM instances
+# or jsonable_encoder pass. Unrequested fields stay unset and are left out.
+@router.get("/transactions", response_model=TransactionPage, response_model_exclude_unset=True)
+async def list_transactions(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str = None,
+    status: str = None,
+    currency: str = None,
+    created_from: datetime = None,
+    created_to: datetime = None,
+    fields: str = FIELDS_QUERY,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """List transactions, newest first. Pass `next_cursor` back as `cursor` for the next page"""
+    try:
+        names = parse_fields(fields)
+        after = after_cursor(decode_cursor(cursor)) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # created_at and id are always read, for the next cursor
+    selected = tuple(dict.fromkeys(names + ("created_at", "id")))
+    query = (
+        select(*(Transaction.__table__.c[name] for name in selected))
+        .where(*transaction_filters(status, currency, created_from, created_to))
+        .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+        .limit(limit)
+    )
+    if after is not None:
+        query = query.where(after)
+
+    rows = (await db.execute(query)).all()
+    next_cursor = None
+    if len(rows) == limit:
+        last = dict(zip(selected, rows[-1]))
+        next_cursor = encode_cursor(last["created_at"], last["id"])
+    # zip stops at len(names), dropping the cursor-only columns
+    return {"items": [dict(zip(names, row)) for row in rows], "next_cursor": next_cursor}
+
+# Export rows are read from a server-side cursor this many at a time
+EXPORT_CHUNK_SIZE = settings.export_chunk_size
+EXPORT_COLUMNS = [column.name for column in Transaction.__table__.columns]
 
-@router.get("/transactions/{external_id}")
-async def get_transaction_by_external_id(external_id: str, db: Session = Depends(get_db)):
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value if value is None or isinstance(value, (str, int, float)) else str(value)
+
+@router.get("/transactions/export")
+async def export_transactions(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    status: str = None,
+    currency: str = None,
+    created_from: datetime = None,
+    created_to: datetime = None,
+):
+    """Stream every matching transaction, oldest first, as NDJSON or CSV"""
+    query = (
+        select(*Transaction.__table__.columns)
+        .where(*transaction_filters(status, currency, created_from, created_to))
+        .order_by(Transaction.created_at, Transaction.id)
+        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    )
+
+    async def rows():
+        # Own session: the response body is produced after the endpoint returns
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(query)
+            if format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(EXPORT_COLUMNS)
+                yield buffer.getvalue()
+            async for chunk in result.partitions():
+                if format == "csv":
+                    buffer = io.StringIO()
+                    writer = csv.writer(buffer)
+                    writer.writerows([_export_value(value) for value in row] for row in chunk)
+                    yield buffer.getvalue()
+                else:
+                    yield "".join(
+                        json.dumps(dict(zip(EXPORT_COLUMNS, map(_export_value, row)))) + "\n"
+                        for row in chunk
+                    )
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        rows(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=transactions.{format}"},
+    )
+
+@router.get("/transactions/{external_id}", response_model=TransactionOut, response_model_exclude_unset=True)
+async def get_transaction_by_external_id(external_id: str, fields: str = FIELDS_QUERY, db: AsyncSession = Depends(get_async_db)):
     """✅ NEW ENDPOINT: Get transaction by external ID"""
-    transaction = db.query(Transaction).filter(Transaction.external_id == external_id).first()
-    if not transaction:
+    try:
+        names = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result = await db.execute(
+        select(*(Transaction.__table__.c[name] for name in names))
+        .where(Transaction.external_id == external_id)
+        .limit(1)
+    )
+    row = result.first()
+    if row:
+        return dict(zip(names, row))
+    archived = await archive.lookup(db, external_id=external_id)
+    if not archived:
         raise HTTPException(status_code=404, detail="Transaction not found")
-    return transaction
+    return {name: archived[name] for name in names}
+
+@router.get("/reports/transactions")
+async def transaction_report(
+    group_by: str = Query("day,currency,status", description="Comma-separated subset of day, currency, status"),
+    date_from: date = None,
+    date_to: date = None,
+    currency: str = None,
+    status: str = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Transaction count and amount by day, currency and status, served from the rollup tables"""
+    columns = tuple(column.strip() for column in group_by.split(",") if column.strip())
+    unknown = [column for column in columns if column not in rollups.GROUP_COLUMNS]
+    if not columns or unknown:
+        raise HTTPException(status_code=400, detail=f"group_by must be a subset of {', '.join(rollups.GROUP_COLUMNS)}")
+    items = await rollups.report(db, columns, date_from, date_to, currency, status)
+    return {"group_by": list(columns), "items": items}
+
+@router.get("/reconciliation/stats")
+async def reconciliation_stats():
+    """Counters from the background reconciliation worker"""
+    return reconciler.get_stats()
+
+@router.get("/outbox/stats")
+async def outbox_stats(db: AsyncSession = Depends(get_async_db)):
+    """Backlog and counters from the outbox dispatcher"""
+    await outbox.refresh_backlog(db)
+    return outbox.get_stats()
+
+@router.get("/status-cache/stats")
+async def status_cache_stats():
+    """Hit/miss counters for the payment status cache"""
+    return status_cache.stats()
+
+# The per-status row count is a GROUP BY over the table, so it is refreshed at most this often
+METRICS_STATUS_COUNT_TTL = settings.metrics_status_count_ttl
+_status_counts_at = 0.0
+
+@router.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(db: AsyncSession = Depends(get_async_db)):
+    """Prometheus metrics for this worker process"""
+    global _status_counts_at
+    if time.monotonic() - _status_counts_at > METRICS_STATUS_COUNT_TTL:
+        result = await db.execute(select(Transaction.status, func.count()).group_by(Transaction.status))
+        metrics.transactions_by_status.replace({(row[0],): row[1] for row in result.all()})
+        if outbox.OUTBOX_ENABLED:
+            await outbox.refresh_backlog(db)
+        _status_counts_at = time.monotonic()
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 @router.get("/config/test")
 async def test_config():
     """Test if configuration is loaded correctly (without sensitive data)"""
     return {
-        "api_user_id": CONFIG["API_USER_ID"][:8] + "..." if CONFIG["API_USER_ID"] else None,
-        "target_environment": CONFIG["TARGET_ENVIRONMENT"],
-        "momo_base_url": CONFIG["MOMO_BASE_URL"],
+        "api_user_id": settings.api_user_id[:8] + "..." if settings.api_user_id else None,
+        "target_environment": settings.target_environment,
+        "momo_base_url": settings.momo_base_url,
         "config_loaded": all([
-            CONFIG["SUBSCRIPTION_PRIMARY_KEY"],
-            CONFIG["API_USER_ID"], 
-            CONFIG["API_KEY"]
+            settings.subscription_primary_key,
+            settings.api_user_id, 
+            settings.api_key
         ])
     }
\ No newline at end of file
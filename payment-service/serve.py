@@ -0,0 +1,86 @@
+"""Production server: several worker processes sharing one preloaded app.
+
+    python serve.py                  # one worker per CPU core
+    python serve.py --workers 4 --port 8080
+
+The app is imported once in the master process and forked into the
+workers (gunicorn with uvicorn workers), so startup cost is paid once.
+WEB_CONCURRENCY is set before the settings are read, so the database and
+Momo connection budgets (DB_CONNECTION_BUDGET, MOMO_CONNECTION_BUDGET) are
+split across the workers. Every worker starts the background jobs, but
+the reconciler and the archiver only run in the worker holding their
+lease (leases.py), so Momo sees one status sweep whatever the worker
+count. On SIGTERM each worker stops accepting connections and gets
+SHUTDOWN_GRACE_SECONDS to finish in-flight requests, then as long again
+to finish claimed outbox batches, before it is killed.
+"""
+import argparse
+import importlib.util
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--workers", type=int, help="worker processes (default WEB_CONCURRENCY, else the CPU count)")
+parser.add_argument("--host", help="bind address (default HOST)")
+parser.add_argument("--port", type=int, help="bind port (default PORT)")
+
+
+def post_fork(server, worker):
+    """Drop database connections inherited from the master; each worker opens its own"""
+    from database import async_engine, engine
+
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+
+
+def run_gunicorn(workers: int, host: str, port: int, grace: float):
+    from gunicorn.app.base import BaseApplication
+    from uvicorn_worker import UvicornWorker
+
+    class GracefulUvicornWorker(UvicornWorker):
+        # Uvicorn otherwise waits for open connections with no limit
+        CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "timeout_graceful_shutdown": grace}
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", GracefulUvicornWorker)
+            self.cfg.set("preload_app", True)
+            # In-flight requests, then the outbox drain in the lifespan shutdown, each get `grace`
+            self.cfg.set("graceful_timeout", max(1, round(2 * grace)))
+            self.cfg.set("post_fork", post_fork)
+
+        def load(self):
+            from main import app
+
+            return app
+
+    Server().run()
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    # Must be set before settings is imported, since it sizes the per-worker pools
+    os.environ["WEB_CONCURRENCY"] = str(args.workers or os.getenv("WEB_CONCURRENCY") or os.cpu_count() or 1)
+
+    from settings import settings
+
+    host = args.host or settings.host
+    port = args.port or settings.port
+    if importlib.util.find_spec("gunicorn") and importlib.util.find_spec("uvicorn_worker"):
+        run_gunicorn(settings.web_concurrency, host, port, settings.shutdown_grace_seconds)
+    else:
+        # No gunicorn (e.g. on Windows): uvicorn's own process manager, without preloading
+        import uvicorn
+
+        logger.warning("gunicorn is not installed, starting uvicorn workers instead")
+        uvicorn.run(
+            "main:app",
+            host=host,
+            port=port,
+            workers=settings.web_concurrency,
+            timeout_graceful_shutdown=settings.shutdown_grace_seconds,
+        )
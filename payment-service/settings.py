@@ -0,0 +1,154 @@
+"""Service settings, read once from the environment and shared by every module.
+
+Each field is filled from the environment variable of the same name in
+upper case (database_url <- DATABASE_URL). `.env` is loaded here, once,
+before anything is read, and the values are validated and converted by
+pydantic, so a bad value fails at startup instead of on first use.
+
+    from settings import settings
+    settings.db_pool_size
+"""
+import os
+from functools import lru_cache
+from typing import Optional
+from dotenv import load_dotenv
+from pydantic import BaseModel, ConfigDict, Field
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Settings(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    # Momo API credentials; checked by main.py when the app starts, so scripts
+    # that only touch the database can run without them
+    subscription_primary_key: Optional[str] = None
+    api_user_id: Optional[str] = None
+    api_key: Optional[str] = None
+    target_environment: Optional[str] = None
+    momo_base_url: Optional[str] = None
+
+    # Access token and callbacks
+    momo_token_refresh_margin: int = Field(300, ge=0)
+    momo_token_cache_file: Optional[str] = None
+    momo_callback_url: Optional[str] = None
+    # Required with momo_callback_url; without it every callback is rejected
+    momo_callback_secret: str = ""
+
+    # Momo HTTP client, per worker process
+    momo_connect_timeout: float = Field(5, gt=0)
+    momo_read_timeout: float = Field(15, gt=0)
+    momo_pool_timeout: float = Field(5, gt=0)
+    momo_total_timeout: float = Field(30, gt=0)
+    momo_max_connections: int = Field(100, ge=1)
+    momo_max_keepalive: int = Field(20, ge=0)
+    momo_keepalive_expiry: float = Field(30, ge=0)
+    # Momo connections for all workers together; overrides momo_max_connections when set
+    momo_connection_budget: Optional[int] = Field(None, ge=1)
+
+    # Circuit breaker and adaptive concurrency limit
+    momo_breaker_window: float = Field(30, gt=0)
+    momo_breaker_min_calls: int = Field(20, ge=1)
+    momo_breaker_failure_rate: float = Field(0.5, gt=0, le=1)
+    momo_breaker_slow_call: float = Field(5, gt=0)
+    momo_breaker_slow_rate: float = Field(0.8, gt=0, le=1)
+    momo_breaker_open_seconds: float = Field(30, gt=0)
+    momo_breaker_half_open_calls: int = Field(3, ge=1)
+    momo_limit_initial: int = Field(50, ge=1)
+    momo_limit_min: int = Field(5, ge=1)
+    # Defaults to the worker's Momo connection count
+    momo_limit_max: Optional[int] = Field(None, ge=1)
+    momo_limit_latency_target: float = Field(2, gt=0)
+
+    # Database, pool sizes per worker process
+    database_url: str
+    db_pool_size: int = Field(10, ge=1)
+    db_max_overflow: int = Field(20, ge=0)
+    db_pool_timeout: float = Field(30, gt=0)
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    # Database connections for all workers together; overrides the two pool sizes when set
+    db_connection_budget: Optional[int] = Field(None, ge=1)
+
+    # Background reconciliation of PENDING transactions
+    reconciler_enabled: bool = False
+    reconcile_interval: float = Field(5, gt=0)
+    reconcile_batch_size: int = Field(200, ge=1)
+    reconcile_concurrency: int = Field(20, ge=1)
+    reconcile_min_backoff: float = Field(5, gt=0)
+    reconcile_max_backoff: float = Field(600, gt=0)
+
+    # Idempotency keys and the payment status cache
+    idempotency_ttl: int = Field(86400, ge=1)
+    idempotency_cache_size: int = Field(10000, ge=1)
+    # A reservation not completed within this long is taken to be from a dead worker; defaults to 4x momo_total_timeout
+    idempotency_lease_seconds: Optional[float] = Field(None, gt=0)
+    status_cache_size: int = Field(50000, ge=1)
+    status_cache_pending_ttl: float = Field(2, ge=0)
+
+    # Routes
+    bulk_concurrency: int = Field(50, ge=1)
+    export_chunk_size: int = Field(1000, ge=1)
+    metrics_status_count_ttl: float = Field(15, ge=0)
+
+    # Outbox dispatcher (asynchronous payment submission)
+    outbox_enabled: bool = False
+    outbox_workers: int = Field(4, ge=1)
+    outbox_batch_size: int = Field(50, ge=1)
+    outbox_concurrency: int = Field(20, ge=1)
+    outbox_poll_interval: float = Field(1, gt=0)
+    outbox_lease_seconds: float = Field(60, gt=0)
+    outbox_max_attempts: int = Field(8, ge=1)
+    outbox_min_backoff: float = Field(2, gt=0)
+    outbox_max_backoff: float = Field(300, gt=0)
+
+    # Extra time a reconciler or archive lease outlives its interval before another worker takes over
+    background_lease_seconds: float = Field(60, gt=0)
+
+    # Rollups and archive
+    rollup_compact_interval: float = Field(5, gt=0)
+    rollup_compact_batch: int = Field(10000, ge=1)
+    archive_dir: str = os.path.join(SERVICE_DIR, "archive")
+    archive_after_days: float = Field(90, ge=0)
+    archive_chunk_size: int = Field(5000, ge=1)
+    archive_block_rows: int = Field(100, ge=1)
+    archive_interval: float = Field(0, ge=0)
+
+    # Serving (serve.py)
+    host: str = "0.0.0.0"
+    port: int = 8000
+    # Worker processes; serve.py defaults it to the CPU count
+    web_concurrency: int = Field(1, ge=1)
+    # How long a stopping worker waits for in-flight payments before it is killed
+    shutdown_grace_seconds: float = Field(60, gt=0)
+
+    def missing_momo_config(self) -> list:
+        """Names of the Momo settings the API cannot work without"""
+        required = ("subscription_primary_key", "api_user_id", "api_key", "momo_base_url")
+        return [name.upper() for name in required if not getattr(self, name)]
+
+    def db_pool_limits(self) -> tuple:
+        """(pool_size, max_overflow) for this worker"""
+        if self.db_connection_budget:
+            # A hard share of the budget: no overflow past it
+            return max(1, self.db_connection_budget // self.web_concurrency), 0
+        return self.db_pool_size, self.db_max_overflow
+
+    def momo_connections(self) -> int:
+        """Momo connection pool size for this worker"""
+        if self.momo_connection_budget:
+            return max(1, self.momo_connection_budget // self.web_concurrency)
+        return self.momo_max_connections
+
+
+def _from_environment() -> dict:
+    return {name: os.environ[name.upper()] for name in Settings.model_fields if name.upper() in os.environ}
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    load_dotenv()
+    return Settings(**_from_environment())
+
+
+settings = get_settings()
@@ -0,0 +1,107 @@
+import asyncio
+from cache import LRUCache
+import metrics
+from settings import settings
+
+# Bounded read-through cache for GET /payment/status
+STATUS_CACHE_SIZE = settings.status_cache_size
+# Non-final statuses are only trusted for this many seconds
+STATUS_CACHE_PENDING_TTL = settings.status_cache_pending_ttl
+
+# Statuses that never change once reached, so they can stay cached until evicted
+TERMINAL_STATUSES = ("SUCCESSFUL", "FAILED")
+
+
+class _Load:
+    """One in-flight load that concurrent lookups for the same key wait on"""
+
+    def __init__(self):
+        self.future = asyncio.get_running_loop().create_future()
+        self.stale = False
+
+
+class StatusCache:
+    """Read-through cache of payment statuses keyed by reference id.
+
+    Terminal statuses stay until LRU eviction; anything else expires after
+    STATUS_CACHE_PENDING_TTL. Concurrent misses for one key share a single
+    load, and invalidate() drops both the entry and any load in progress.
+    """
+
+    def __init__(self, maxsize: int = STATUS_CACHE_SIZE, pending_ttl: float = STATUS_CACHE_PENDING_TTL):
+        self.pending_ttl = pending_ttl
+        self._entries = LRUCache(maxsize=maxsize)
+        self._loads = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    async def get(self, reference_id: str, loader):
+        """Return the cached status for `reference_id`, calling `loader()` on a miss"""
+        value = self._entries.get(reference_id)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        load = self._loads.get(reference_id)
+        if load is not None:
+            self.coalesced += 1
+            return await asyncio.shield(load.future)
+
+        self.misses += 1
+        load = self._loads[reference_id] = _Load()
+        # The load runs in its own task so a cancelled first caller doesn't fail the others
+        asyncio.create_task(self._run(reference_id, load, loader))
+        return await asyncio.shield(load.future)
+
+    async def _run(self, reference_id: str, load: _Load, loader):
+        try:
+            value = await loader()
+        except BaseException as e:
+            load.future.set_exception(e)
+            # Mark the exception retrieved in case every waiter was cancelled
+            load.future.exception()
+        else:
+            if not load.stale:
+                ttl = None if value.status in TERMINAL_STATUSES else self.pending_ttl
+                self._entries.set(reference_id, value, ttl=ttl)
+            load.future.set_result(value)
+        finally:
+            if self._loads.get(reference_id) is load:
+                del self._loads[reference_id]
+
+    def invalidate(self, reference_id: str):
+        """Forget `reference_id` after its row changed"""
+        self.invalidations += 1
+        self._entries.pop(reference_id)
+        load = self._loads.pop(reference_id, None)
+        if load is not None:
+            load.stale = True
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "maxsize": self._entries.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+
+status_cache = StatusCache()
+
+metrics.Counter(
+    "status_cache_lookups_total",
+    "Payment status cache lookups by result",
+    ("result",),
+    function=lambda: {
+        ("hit",): status_cache.hits,
+        ("miss",): status_cache.misses,
+        ("coalesced",): status_cache.coalesced,
+    },
+)
+metrics.Gauge("status_cache_entries", "Entries in the payment status cache", function=lambda: len(status_cache._entries))
@@ -0,0 +1,34 @@
+import asyncio
+import os
+import sys
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+# The service is a flat set of modules imported by name, as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# settings.py needs a database URL at import time
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+
+@pytest.fixture
+def sessions():
+    """Factory for an in-memory SQLite database: sessions(Transaction, ...) creates those tables and returns a sessionmaker"""
+    engines = []
+
+    def create(*models):
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        engines.append(engine)
+
+        async def create_tables():
+            async with engine.begin() as conn:
+                for model in models:
+                    await conn.run_sync(model.__table__.create)
+
+        asyncio.run(create_tables())
+        # Same options as database.AsyncSessionLocal
+        return async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+    yield create
+    for engine in engines:
+        asyncio.run(engine.dispose())
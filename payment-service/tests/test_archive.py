@@ -0,0 +1,115 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import func, select
+import archive
+from models import Transaction, TransactionArchiveIndex
+
+
+@pytest.fixture
+def archive_db(sessions, tmp_path, monkeypatch):
+    archive_sessions = sessions(Transaction, TransactionArchiveIndex)
+    monkeypatch.setattr(archive, "AsyncSessionLocal", archive_sessions)
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    return archive_sessions
+
+
+def insert_settled(archive_db, count):
+    """`count` SUCCESSFUL transactions, a week old, one second apart; returns them oldest first"""
+    week_ago = datetime.utcnow() - timedelta(days=7)
+    rows = [
+        {
+            "id": str(uuid.uuid4()),
+            "momo_reference_id": str(uuid.uuid4()),
+            "external_id": f"order-{index}",
+            "amount": 10,
+            "currency": "EUR",
+            "payer_phone_number": "46733123450",
+            "status": "SUCCESSFUL",
+            "created_at": week_ago + timedelta(seconds=index),
+            "updated_at": week_ago + timedelta(seconds=index),
+        }
+        for index in range(count)
+    ]
+
+    async def main():
+        async with archive_db() as db:
+            db.add_all(Transaction(**row) for row in rows)
+            await db.commit()
+
+    asyncio.run(main())
+    return rows
+
+
+def count(archive_db, model):
+    async def main():
+        async with archive_db() as db:
+            return await db.scalar(select(func.count()).select_from(model))
+
+    return asyncio.run(main())
+
+
+def test_run_stops_when_the_lease_is_lost(archive_db, monkeypatch):
+    insert_settled(archive_db, 5)
+    monkeypatch.setattr(archive, "ARCHIVE_CHUNK_SIZE", 2)
+    renewals = []
+
+    async def acquire(name, interval):
+        # Another worker takes the lease over after the first renewal
+        renewals.append(name)
+        return len(renewals) == 1
+
+    monkeypatch.setattr(archive.leases, "acquire", acquire)
+
+    assert asyncio.run(archive.run(after_days=1, renew_lease=True)) == 4
+    assert renewals == ["archive", "archive"]
+    assert count(archive_db, Transaction) == 1
+    assert archive._stats["leader"] is False
+
+
+def block_count(archive_db):
+    async def main():
+        async with archive_db() as db:
+            blocks = select(TransactionArchiveIndex.archive_file, TransactionArchiveIndex.block_offset).distinct().subquery()
+            return await db.scalar(select(func.count()).select_from(blocks))
+
+    return asyncio.run(main())
+
+
+def lookup(archive_db, **by):
+    async def main():
+        async with archive_db() as db:
+            return await archive.lookup(db, **by)
+
+    return asyncio.run(main())
+
+
+def test_archived_rows_round_trip(archive_db, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_BLOCK_ROWS", 4)
+    monkeypatch.setattr(archive, "ARCHIVE_CHUNK_SIZE", 25)
+    rows = insert_settled(archive_db, 30)
+
+    assert asyncio.run(archive.run(after_days=1)) == 30
+    assert count(archive_db, Transaction) == 0
+    assert count(archive_db, TransactionArchiveIndex) == 30
+    assert block_count(archive_db) == 7 + 2
+
+    # First, a middle and the last block of the first file, and the second file
+    for row in (rows[0], rows[13], rows[24], rows[29]):
+        by_external_id = lookup(archive_db, external_id=row["external_id"])
+        by_reference_id = lookup(archive_db, reference_id=row["momo_reference_id"])
+        assert by_external_id == by_reference_id
+        assert by_external_id["id"] == row["id"]
+        assert by_external_id["momo_reference_id"] == row["momo_reference_id"]
+        assert by_external_id["created_at"] == row["created_at"].isoformat()
+    assert lookup(archive_db, external_id="order-unknown") is None
+
+
+def test_missing_archive_file_is_not_found(archive_db, tmp_path):
+    row, = insert_settled(archive_db, 1)
+    asyncio.run(archive.run(after_days=1))
+    for path in tmp_path.rglob("*.jsonl.gz"):
+        path.unlink()
+
+    assert lookup(archive_db, external_id=row["external_id"]) is None
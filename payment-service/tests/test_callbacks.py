@@ -0,0 +1,27 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import routes
+import utils
+
+
+def test_callback_token_fails_closed_without_secret(monkeypatch):
+    monkeypatch.setattr(utils, "CALLBACK_SECRET", "")
+    assert not utils.verify_callback_token("ref-1", "")
+    assert not utils.verify_callback_token("ref-1", "anything")
+
+
+def test_callback_token_round_trip(monkeypatch):
+    monkeypatch.setattr(utils, "CALLBACK_SECRET", "s3cret")
+    assert utils.verify_callback_token("ref-1", utils.callback_token("ref-1"))
+    assert not utils.verify_callback_token("ref-2", utils.callback_token("ref-1"))
+
+
+def test_unsigned_callback_is_rejected(monkeypatch):
+    monkeypatch.setattr(utils, "CALLBACK_SECRET", "")
+    app = FastAPI()
+    app.include_router(routes.router)
+    response = TestClient(app).post(
+        "/payment/callback/ref-1",
+        json={"status": "SUCCESSFUL", "financialTransactionId": "forged"},
+    )
+    assert response.status_code == 403
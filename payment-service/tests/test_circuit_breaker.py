@@ -0,0 +1,166 @@
+import asyncio
+import types
+import pytest
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, AdaptiveLimiter, CircuitBreaker, UpstreamUnavailable
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A fake time.monotonic for the breaker; advance it with clock.now += seconds"""
+    clock = types.SimpleNamespace(now=1000.0)
+    # Only the breaker's view of time; the event loop keeps the real clock
+    monkeypatch.setattr(circuit_breaker, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def breaker(**options):
+    defaults = dict(window=30, min_calls=4, failure_rate=0.5, slow_call_seconds=5, slow_rate=0.8,
+                    open_seconds=30, half_open_calls=2)
+    return CircuitBreaker(**{**defaults, **options})
+
+
+def call(breaker, duration=0.1, failed=False):
+    breaker.before_call()
+    breaker.record(duration, failed)
+
+
+def trip(breaker):
+    for _ in range(breaker.min_calls):
+        call(breaker, failed=True)
+    assert breaker.state == OPEN
+
+
+def test_opens_on_failure_rate(clock):
+    b = breaker()
+    call(b, failed=True)
+    call(b)
+    call(b)
+    # Under min_calls nothing opens, even at a 100% failure rate so far
+    assert b.state == CLOSED
+    call(b, failed=True)
+    assert b.state == OPEN
+    with pytest.raises(UpstreamUnavailable) as raised:
+        b.before_call()
+    assert raised.value.status_code == 503
+    assert raised.value.retry_after == 30
+
+
+def test_opens_on_slow_call_rate(clock):
+    b = breaker()
+    for _ in range(3):
+        call(b, duration=6)
+    call(b)
+    assert b.state == CLOSED
+    call(b, duration=6)
+    # 4 slow calls out of 5
+    assert b.state == OPEN
+
+
+def test_calls_outside_the_window_are_forgotten(clock):
+    b = breaker()
+    call(b, failed=True)
+    call(b, failed=True)
+    clock.now += 31
+    call(b, failed=True)
+    call(b)
+    call(b)
+    assert b.state == CLOSED
+    assert b.stats()["window_calls"] == 3
+
+
+def test_half_open_after_open_seconds_then_closes(clock):
+    b = breaker()
+    trip(b)
+    clock.now += 29
+    with pytest.raises(UpstreamUnavailable):
+        b.before_call()
+    assert b.retry_after() == pytest.approx(1)
+
+    clock.now += 1
+    b.before_call()
+    assert b.state == HALF_OPEN
+    b.before_call()
+    # Only half_open_calls probes at a time
+    with pytest.raises(UpstreamUnavailable):
+        b.before_call()
+    b.record(0.1, failed=False)
+    assert b.state == HALF_OPEN
+    b.record(0.1, failed=False)
+    assert b.state == CLOSED
+
+
+def test_failed_probe_reopens(clock):
+    b = breaker()
+    trip(b)
+    clock.now += 30
+    b.before_call()
+    b.record(0.1, failed=True)
+    assert b.state == OPEN
+    assert b.opened_total == 2
+    assert b.retry_after() == 30
+
+
+def test_cancelled_probe_frees_its_slot(clock):
+    b = breaker()
+    trip(b)
+    clock.now += 30
+    b.before_call()
+    b.before_call()
+    with pytest.raises(UpstreamUnavailable):
+        b.before_call()
+    b.cancel_call()
+    b.before_call()
+    assert b.state == HALF_OPEN
+
+
+def test_limiter_grows_additively_and_backs_off_multiplicatively():
+    limiter = AdaptiveLimiter(initial=10, min_limit=5, max_limit=11, latency_target=2, backoff=0.5)
+
+    async def main():
+        for _ in range(10):
+            await limiter.acquire()
+            limiter.release(duration=0.1)
+        # About one more slot per `limit` fast calls
+        assert limiter.limit == pytest.approx(11, abs=0.05)
+        for _ in range(5):
+            await limiter.acquire()
+            limiter.release(duration=0.1)
+        assert limiter.limit == 11
+
+        await limiter.acquire()
+        limiter.release(duration=3)
+        assert limiter.limit == 5.5
+        await limiter.acquire()
+        limiter.release(duration=0.1, failed=True)
+        assert limiter.limit == 5
+
+        # A call that never reached upstream leaves the limit alone
+        await limiter.acquire()
+        limiter.release()
+        assert limiter.limit == 5
+        assert limiter.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_limiter_rejects_or_waits_when_full():
+    limiter = AdaptiveLimiter(initial=1, min_limit=1)
+
+    async def main():
+        await limiter.acquire()
+        with pytest.raises(UpstreamUnavailable):
+            await limiter.acquire()
+        with pytest.raises(UpstreamUnavailable):
+            await limiter.acquire(wait=True, timeout=0.05)
+        assert limiter.rejected_total == 2
+
+        # A waiter gets the slot once it is released
+        waiter = asyncio.ensure_future(limiter.acquire(wait=True, timeout=1))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        limiter.release(duration=0.1)
+        await waiter
+        assert limiter.in_flight == 1
+
+    asyncio.run(main())
@@ -0,0 +1,180 @@
+import asyncio
+from datetime import datetime, timedelta
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import select, update
+import idempotency
+import routes
+from database import get_async_db
+from models import IdempotencyKey, Transaction
+
+
+@pytest.fixture
+def keys(sessions):
+    idempotency._completed._data.clear()
+    return sessions(IdempotencyKey)
+
+
+def test_retryable_rejections_are_not_final():
+    assert not any(idempotency.is_final(code) for code in (401, 408, 429, 500, 503))
+    assert all(idempotency.is_final(code) for code in (400, 403, 409, 422))
+
+
+def test_stale_reservation_is_taken_over(keys):
+    async def main():
+        async with keys() as db:
+            assert await idempotency.begin(db, "key:a", "hash") is None
+        async with keys() as db:
+            with pytest.raises(HTTPException) as in_progress:
+                await idempotency.begin(db, "key:a", "hash")
+            assert in_progress.value.status_code == 409
+
+            # The reserving worker died; its lease runs out
+            expired = datetime.utcnow() - timedelta(seconds=idempotency.IDEMPOTENCY_LEASE_SECONDS + 1)
+            await db.execute(update(IdempotencyKey).values(created_at=expired))
+            await db.commit()
+            assert await idempotency.begin(db, "key:a", "hash") is None
+        async with keys() as db:
+            # The new holder has a fresh lease
+            with pytest.raises(HTTPException):
+                await idempotency.begin(db, "key:a", "hash")
+
+    asyncio.run(main())
+
+
+def test_rate_limited_request_is_retried_not_replayed(keys, monkeypatch):
+    responses = [HTTPException(status_code=429, detail="MTN Momo API Error: rate limited"), {"status": "PENDING"}]
+    calls = []
+
+    async def submit(payment_req, db):
+        calls.append(payment_req)
+        response = responses[len(calls) - 1]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    async def get_db():
+        async with keys() as db:
+            yield db
+
+    monkeypatch.setattr(routes, "_submit_payment", submit)
+    monkeypatch.setattr(routes.outbox, "OUTBOX_ENABLED", False)
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.dependency_overrides[get_async_db] = get_db
+    client = TestClient(app)
+
+    request = {"amount": "10", "payer_phone_number": "46733123450"}
+    headers = {"Idempotency-Key": "retry-me"}
+    first = client.post("/payment/request", json=request, headers=headers)
+    second = client.post("/payment/request", json=request, headers=headers)
+    third = client.post("/payment/request", json=request, headers=headers)
+
+    assert first.status_code == 429
+    assert second.status_code == 202 and "Idempotent-Replayed" not in second.headers
+    assert third.status_code == 202 and third.headers["Idempotent-Replayed"] == "true"
+    assert len(calls) == 2
+
+
+@pytest.fixture
+def payments(sessions, monkeypatch):
+    """Client for the real _submit_payment, with request_to_pay replaced by `payments.momo`"""
+    idempotency._completed._data.clear()
+    db_sessions = sessions(IdempotencyKey, Transaction)
+
+    async def get_db():
+        async with db_sessions() as db:
+            yield db
+
+    async def request_to_pay(reference_id, payment_req, shed=True):
+        client.sent.append(reference_id)
+        return await client.momo(reference_id)
+
+    monkeypatch.setattr(routes, "request_to_pay", request_to_pay)
+    monkeypatch.setattr(routes.outbox, "OUTBOX_ENABLED", False)
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.dependency_overrides[get_async_db] = get_db
+    client = TestClient(app)
+    client.sent = []
+
+    async def transactions():
+        async with db_sessions() as db:
+            return (await db.execute(select(Transaction.momo_reference_id, Transaction.status))).all()
+
+    client.transactions = lambda: asyncio.run(transactions())
+    return client
+
+
+def test_timeout_after_sending_is_replayed_not_resent(payments):
+    async def momo(reference_id):
+        raise httpx.ReadTimeout("timed out waiting for Momo")
+
+    payments.momo = momo
+    request = {"amount": "10", "payer_phone_number": "46733123450"}
+    headers = {"Idempotency-Key": "pay-once"}
+    first = payments.post("/payment/request", json=request, headers=headers)
+    second = payments.post("/payment/request", json=request, headers=headers)
+
+    assert first.status_code == 500
+    assert second.status_code == 500 and second.headers["Idempotent-Replayed"] == "true"
+    assert second.json() == first.json()
+    assert len(payments.sent) == 1
+    assert first.json()["detail"]["reference_id"] == payments.sent[0]
+    # Left for the reconciler to settle from Momo
+    assert payments.transactions() == [(payments.sent[0], "ERROR")]
+
+
+def test_momo_server_error_is_replayed_not_resent(payments):
+    async def momo(reference_id):
+        return httpx.Response(503, text="upstream busy")
+
+    payments.momo = momo
+    request = {"amount": "10", "payer_phone_number": "46733123450"}
+    headers = {"Idempotency-Key": "pay-once"}
+    first = payments.post("/payment/request", json=request, headers=headers)
+    second = payments.post("/payment/request", json=request, headers=headers)
+
+    assert first.status_code == second.status_code == 503
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert len(payments.sent) == 1
+
+
+def test_connect_failure_is_retried(payments):
+    outcomes = [httpx.ConnectError("connection refused"), httpx.Response(202)]
+
+    async def momo(reference_id):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    payments.momo = momo
+    request = {"amount": "10", "payer_phone_number": "46733123450"}
+    headers = {"Idempotency-Key": "pay-once"}
+    first = payments.post("/payment/request", json=request, headers=headers)
+    second = payments.post("/payment/request", json=request, headers=headers)
+
+    # The request never left the process, so the retry may send it
+    assert first.status_code == 500
+    assert second.status_code == 202 and "Idempotent-Replayed" not in second.headers
+    assert len(payments.sent) == 2
+
+
+def test_bulk_marks_only_final_rejections_failed(payments, monkeypatch):
+    answers = {"order-1": 400, "order-2": 429, "order-3": 503, "order-4": 202}
+
+    async def request_to_pay(reference_id, payment_req, shed=True):
+        return httpx.Response(answers[payment_req.external_id], text="momo says no")
+
+    monkeypatch.setattr(routes, "request_to_pay", request_to_pay)
+    response = payments.post("/payment/request/bulk", json={"payments": [
+        {"amount": "10", "payer_phone_number": "46733123450", "external_id": external_id}
+        for external_id in answers
+    ]})
+
+    body = response.json()
+    assert [result["status"] for result in body["results"]] == ["FAILED", "ERROR", "ERROR", "PENDING"]
+    assert (body["pending"], body["failed"], body["error"]) == (1, 1, 2)
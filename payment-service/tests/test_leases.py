@@ -0,0 +1,43 @@
+import asyncio
+import pytest
+import leases
+from models import BackgroundLease
+
+
+@pytest.fixture
+def lease_table(sessions, monkeypatch):
+    monkeypatch.setattr(leases, "AsyncSessionLocal", sessions(BackgroundLease))
+
+
+def as_worker(monkeypatch, name):
+    monkeypatch.setattr(leases, "holder", lambda: name)
+
+
+def test_one_worker_holds_the_lease(lease_table, monkeypatch):
+    async def main():
+        taken = []
+        for worker in ("worker-1", "worker-2", "worker-3", "worker-1"):
+            as_worker(monkeypatch, worker)
+            taken.append(await leases.acquire("reconciler", 5))
+        return taken
+
+    assert asyncio.run(main()) == [True, False, False, True]
+
+
+def test_expired_or_released_lease_is_taken_over(lease_table, monkeypatch):
+    monkeypatch.setattr(leases, "BACKGROUND_LEASE_SECONDS", 0)
+
+    async def main():
+        as_worker(monkeypatch, "worker-1")
+        assert await leases.acquire("archive", 0.05)
+        as_worker(monkeypatch, "worker-2")
+        assert not await leases.acquire("archive", 0.05)
+        # worker-1 died without renewing
+        await asyncio.sleep(0.1)
+        assert await leases.acquire("archive", 60)
+
+        await leases.release("archive")
+        as_worker(monkeypatch, "worker-3")
+        assert await leases.acquire("archive", 60)
+
+    asyncio.run(main())
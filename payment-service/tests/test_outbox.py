@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+import outbox
+from circuit_breaker import UpstreamUnavailable
+from models import PaymentOutbox, PaymentRequest
+
+
+def test_local_refusals_do_not_use_up_attempts(sessions, monkeypatch):
+    outbox_sessions = sessions(PaymentOutbox)
+
+    async def request_to_pay(reference_id, payment_req, shed=True):
+        raise UpstreamUnavailable("circuit open", 30)
+
+    monkeypatch.setattr(outbox, "AsyncSessionLocal", outbox_sessions)
+    monkeypatch.setattr(outbox, "request_to_pay", request_to_pay)
+
+    async def main():
+        payment_req = PaymentRequest(amount="10", external_id="order-1", payer_phone_number="46733123450")
+        async with outbox_sessions() as db:
+            db.add(PaymentOutbox(**outbox.entry("transaction-1", "ref-1", payment_req)))
+            await db.commit()
+
+        semaphore = asyncio.Semaphore(1)
+        # Far more refusals than OUTBOX_MAX_ATTEMPTS allows real failures
+        for _ in range(outbox.OUTBOX_MAX_ATTEMPTS + 2):
+            assert await outbox.dispatch_batch("worker", semaphore) == 1
+            async with outbox_sessions() as db:
+                row = (await db.execute(select(PaymentOutbox))).scalars().one()
+                assert row.next_attempt_at > datetime.utcnow() + timedelta(seconds=25)
+                await db.execute(update(PaymentOutbox).values(next_attempt_at=datetime.utcnow()))
+                await db.commit()
+        async with outbox_sessions() as db:
+            return (await db.execute(select(PaymentOutbox))).scalars().one()
+
+    row = asyncio.run(main())
+    assert row.state == "PENDING"
+    assert row.attempts == 0
+
+
+def test_no_claims_while_breaker_is_open(monkeypatch):
+    claims = []
+
+    async def dispatch_batch(worker, semaphore):
+        claims.append(worker)
+        return 0
+
+    monkeypatch.setattr(outbox, "dispatch_batch", dispatch_batch)
+    monkeypatch.setattr(outbox.momo_client.breaker, "retry_after", lambda: 30.0)
+
+    async def main():
+        monkeypatch.setattr(outbox, "_wakeup", asyncio.Event())
+        task = asyncio.create_task(outbox._run("worker", asyncio.Semaphore(1)))
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(main())
+    assert claims == []
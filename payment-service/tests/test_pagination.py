@@ -0,0 +1,65 @@
+import asyncio
+import uuid
+from datetime import datetime
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import routes
+from database import get_async_db
+from models import Transaction
+
+
+@pytest.fixture
+def client(sessions):
+    transaction_sessions = sessions(Transaction)
+
+    async def insert():
+        async with transaction_sessions() as db:
+            # Four rows per timestamp, so page boundaries fall inside ties on created_at
+            for index in range(23):
+                db.add(Transaction(
+                    id=str(uuid.uuid4()),
+                    momo_reference_id=str(uuid.uuid4()),
+                    external_id=f"order-{index}",
+                    amount=10,
+                    currency="EUR",
+                    payer_phone_number="46733123450",
+                    status="PENDING",
+                    created_at=datetime(2026, 10, 1, 12, index // 4),
+                ))
+            await db.commit()
+
+    async def get_db():
+        async with transaction_sessions() as db:
+            yield db
+
+    asyncio.run(insert())
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.dependency_overrides[get_async_db] = get_db
+    return TestClient(app)
+
+
+def test_pages_cover_every_row_once(client):
+    items = []
+    cursor = None
+    while True:
+        params = {"limit": 5, "fields": "external_id,created_at"}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/transactions", params=params).json()
+        items.extend(page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    seen = [item["external_id"] for item in items]
+    assert sorted(seen) == sorted(f"order-{index}" for index in range(23))
+    assert len(seen) == len(set(seen))
+    created = [item["created_at"] for item in items]
+    assert created == sorted(created, reverse=True)
+
+
+def test_malformed_cursor_is_rejected(client):
+    assert client.get("/transactions", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/transactions", params={"fields": "id,nope"}).status_code == 400
@@ -0,0 +1,106 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+import httpx
+import pytest
+from sqlalchemy import select
+import reconciler
+from models import Transaction
+
+
+@pytest.fixture
+def transactions(sessions, monkeypatch):
+    transaction_sessions = sessions(Transaction)
+    monkeypatch.setattr(reconciler, "AsyncSessionLocal", transaction_sessions)
+    monkeypatch.setattr(reconciler, "_last_checked", {})
+    return transaction_sessions
+
+
+def insert(transactions, status, updated_at):
+    reference_id = str(uuid.uuid4())
+
+    async def main():
+        async with transactions() as db:
+            db.add(Transaction(
+                id=str(uuid.uuid4()),
+                momo_reference_id=reference_id,
+                external_id=f"order-{reference_id}",
+                amount=10,
+                currency="EUR",
+                payer_phone_number="46733123450",
+                status=status,
+                created_at=updated_at,
+                updated_at=updated_at,
+            ))
+            await db.commit()
+
+    asyncio.run(main())
+    return reference_id
+
+
+def statuses(transactions):
+    async def main():
+        async with transactions() as db:
+            return dict((await db.execute(select(Transaction.momo_reference_id, Transaction.status))).all())
+
+    return asyncio.run(main())
+
+
+def momo_answers(monkeypatch, answers):
+    async def fetch_payment_status(reference_id, shed=True):
+        answer = answers[reference_id]
+        if isinstance(answer, int):
+            request = httpx.Request("GET", f"https://momo.test/requesttopay/{reference_id}")
+            raise httpx.HTTPStatusError("status check failed", request=request, response=httpx.Response(answer, request=request))
+        return {"status": answer, "financialTransactionId": "12345"}
+
+    monkeypatch.setattr(reconciler, "fetch_payment_status", fetch_payment_status)
+
+
+def test_error_rows_are_settled_from_momo(transactions, monkeypatch):
+    an_hour_ago = datetime.utcnow() - timedelta(hours=1)
+    received = insert(transactions, "ERROR", an_hour_ago)
+    never_sent = insert(transactions, "ERROR", an_hour_ago)
+    pending = insert(transactions, "PENDING", an_hour_ago)
+    momo_answers(monkeypatch, {received: "SUCCESSFUL", never_sent: 404, pending: "PENDING"})
+
+    asyncio.run(reconciler.sweep())
+
+    assert statuses(transactions) == {received: "SUCCESSFUL", never_sent: "FAILED", pending: "PENDING"}
+
+
+def test_recent_error_row_is_not_failed_on_404(transactions, monkeypatch):
+    # A request still in flight may reach Momo after the first check
+    just_now = datetime.utcnow() - timedelta(seconds=1)
+    reference_id = insert(transactions, "ERROR", just_now)
+    momo_answers(monkeypatch, {reference_id: 404})
+    monkeypatch.setattr(reconciler, "backoff_interval", lambda age: 0)
+    checked = reconciler._stats["checked_total"]
+    errors = reconciler._stats["errors_total"]
+
+    asyncio.run(reconciler.sweep())
+
+    assert statuses(transactions) == {reference_id: "ERROR"}
+    assert reconciler._stats["checked_total"] == checked + 1
+    assert reconciler._stats["errors_total"] == errors
+
+
+def test_sweep_stops_when_the_lease_is_lost(transactions, monkeypatch):
+    an_hour_ago = datetime.utcnow() - timedelta(hours=1)
+    reference_ids = [insert(transactions, "PENDING", an_hour_ago + timedelta(seconds=index)) for index in range(3)]
+    momo_answers(monkeypatch, dict.fromkeys(reference_ids, "SUCCESSFUL"))
+    monkeypatch.setattr(reconciler, "RECONCILE_BATCH_SIZE", 1)
+    renewals = []
+
+    async def acquire(name, interval):
+        # Another worker takes the lease over after the first renewal
+        renewals.append(name)
+        return len(renewals) == 1
+
+    monkeypatch.setattr(reconciler.leases, "acquire", acquire)
+
+    asyncio.run(reconciler.sweep(renew_lease=True))
+
+    assert renewals == ["reconciler", "reconciler"]
+    assert list(statuses(transactions).values()).count("SUCCESSFUL") == 2
+    assert reconciler._stats["leader"] is False
@@ -0,0 +1,59 @@
+import asyncio
+import uuid
+import crud
+import routes
+from models import Transaction
+from status_cache import StatusCache
+
+
+def test_pending_status_is_cached_within_ttl(sessions, monkeypatch):
+    transaction_sessions = sessions(Transaction)
+    cache = StatusCache(maxsize=100, pending_ttl=60)
+    upstream_calls = []
+
+    async def fetch_payment_status(reference_id, shed=True):
+        upstream_calls.append(reference_id)
+        return {"status": "PENDING"}
+
+    monkeypatch.setattr(routes, "AsyncSessionLocal", transaction_sessions)
+    monkeypatch.setattr(routes, "status_cache", cache)
+    monkeypatch.setattr(crud, "status_cache", cache)
+    monkeypatch.setattr(routes, "fetch_payment_status", fetch_payment_status)
+    monkeypatch.setattr(routes.reconciler, "RECONCILER_ENABLED", False)
+
+    async def main():
+        reference_id = str(uuid.uuid4())
+        async with transaction_sessions() as db:
+            db.add(Transaction(
+                momo_reference_id=reference_id,
+                external_id="order-1",
+                amount=10,
+                currency="EUR",
+                payer_phone_number="46733123450",
+                status="PENDING",
+            ))
+            await db.commit()
+        return [await routes.get_payment_status(reference_id) for _ in range(5)]
+
+    results = asyncio.run(main())
+    assert [result.status for result in results] == ["PENDING"] * 5
+    assert len(upstream_calls) == 1
+    assert cache.stats()["hits"] == 4 and cache.stats()["misses"] == 1 and cache.stats()["size"] == 1
+
+
+def test_invalidate_during_load_keeps_stale_result_out():
+    cache = StatusCache(maxsize=100, pending_ttl=60)
+
+    class Value:
+        status = "PENDING"
+
+    async def main():
+        async def loader():
+            # The row changes while the load is in flight
+            cache.invalidate("ref-1")
+            return Value()
+
+        await cache.get("ref-1", loader)
+        return cache.stats()
+
+    assert asyncio.run(main())["size"] == 0
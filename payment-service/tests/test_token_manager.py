@@ -0,0 +1,62 @@
+import asyncio
+import time
+import utils
+from utils import MomoTokenManager
+
+
+def test_short_lived_token_is_reused(monkeypatch):
+    minted = []
+
+    async def fetch():
+        minted.append(1)
+        return f"token-{len(minted)}", 60
+
+    monkeypatch.setattr(utils, "_fetch_momo_token", fetch)
+    manager = MomoTokenManager(refresh_margin=300, cache_file=None)
+
+    async def main():
+        return [await manager.get_token() for _ in range(11)]
+
+    assert asyncio.run(main()) == ["token-1"] * 11
+    assert len(minted) == 1
+    # A 60s token is refreshed at half-life, not as soon as it is minted
+    assert manager._refresh_at - time.time() > 25
+
+
+def test_refresh_starts_inside_margin(monkeypatch):
+    minted = []
+
+    async def fetch():
+        minted.append(1)
+        return f"token-{len(minted)}", 3600
+
+    monkeypatch.setattr(utils, "_fetch_momo_token", fetch)
+    manager = MomoTokenManager(refresh_margin=300, cache_file=None)
+
+    async def main():
+        first = await manager.get_token()
+        manager._refresh_at = time.time() - 1
+        # Still valid: served while a new one is fetched in the background
+        second = await manager.get_token()
+        await manager._refresh_task
+        return first, second, await manager.get_token()
+
+    assert asyncio.run(main()) == ("token-1", "token-1", "token-2")
+
+
+def test_workers_share_one_token_through_the_cache_file(monkeypatch, tmp_path):
+    minted = []
+
+    async def fetch():
+        minted.append(1)
+        return f"token-{len(minted)}", 60
+
+    monkeypatch.setattr(utils, "_fetch_momo_token", fetch)
+    cache_file = str(tmp_path / "token.json")
+    workers = [MomoTokenManager(refresh_margin=300, cache_file=cache_file) for _ in range(3)]
+
+    async def main():
+        return [await worker.get_token() for worker in workers]
+
+    assert asyncio.run(main()) == ["token-1"] * 3
+    assert len(minted) == 1
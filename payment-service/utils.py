@@ -1,45 +1,281 @@
-from dotenv import load_dotenv
 import os
-import requests
+import json
+import time
+import asyncio
+import httpx
 from fastapi import  HTTPException
 import base64
+import hashlib
+import hmac
+import logging
+import momo_client
+import metrics
+from settings import settings
 
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl; the shared token file still works, just without the lock
+    fcntl = None
 
-CONFIG = {
-    "SUBSCRIPTION_PRIMARY_KEY": os.getenv("SUBSCRIPTION_PRIMARY_KEY"),
-    "API_USER_ID": os.getenv("API_USER_ID"),
-    "API_KEY": os.getenv("API_KEY"),
-    "TARGET_ENVIRONMENT": os.getenv("TARGET_ENVIRONMENT"),
-    "MOMO_BASE_URL": os.getenv("MOMO_BASE_URL"),
-}
+logger = logging.getLogger(__name__)
 
-def get_momo_token() -> str:
-    """Get access token from MTN Momo API"""
-    url = f"{CONFIG['MOMO_BASE_URL']}/collection/token/"
-    
+# Seconds before expires_in at which the token is refreshed in the background,
+# capped at half the token's lifetime so short-lived tokens are still reused
+TOKEN_REFRESH_MARGIN = settings.momo_token_refresh_margin
+# Optional file shared by all uvicorn workers so they reuse a single token
+TOKEN_CACHE_FILE = settings.momo_token_cache_file
+
+# Public base URL of our callback endpoint, e.g. https://pay.example.com/payment/callback
+CALLBACK_URL = settings.momo_callback_url
+# Secret used to sign each callback URL so forged notifications are rejected
+CALLBACK_SECRET = settings.momo_callback_secret
+
+
+async def _fetch_momo_token() -> tuple:
+    """Get a new access token from MTN Momo API, returns (token, expires_in)"""
     #  base64 encoded string in format: API_USER_ID:API_KEY
-    credentials = f"{CONFIG['API_USER_ID']}:{CONFIG['API_KEY']}"
+    credentials = f"{settings.api_user_id}:{settings.api_key}"
     encoded_credentials = base64.b64encode(credentials.encode()).decode()
-    
-    print(f"🔧 Debug: Encoded credentials: {encoded_credentials}")
-    
+
     headers = {
         "Authorization": f"Basic {encoded_credentials}",
-        "Ocp-Apim-Subscription-Key": CONFIG["SUBSCRIPTION_PRIMARY_KEY"],
+        "Ocp-Apim-Subscription-Key": settings.subscription_primary_key,
     }
-    
+
     try:
-        response = requests.post(url, headers=headers)
-        print(f"🔧 Debug: Token response status: {response.status_code}")
-        print(f"🔧 Debug: Token response text: {response.text}")
-        
+        # Every caller depends on the token, so it queues for a slot rather than being shed
+        response = await momo_client.send("POST", "/collection/token/", shed=False, headers=headers)
+        logger.debug("Token response status: %s", response.status_code)
+
         response.raise_for_status()
         token_data = response.json()
-        print(f"🔧 Debug: Token received: {token_data.get('access_token', '')[:20]}...")
-        return token_data["access_token"]
-    except requests.exceptions.RequestException as e:
-        print(f"🔧 Debug: Token request failed: {str(e)}")
+        return token_data["access_token"], int(token_data.get("expires_in", 3600))
+    except httpx.HTTPError as e:
+        logger.warning("Token request failed: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to get access token: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+
+class MomoTokenManager:
+    """Caches the Momo access token until shortly before it expires.
+
+    Callers in the same process share one in-flight refresh. When a cache
+    file is configured the token is also shared between worker processes.
+    """
+
+    def __init__(self, refresh_margin: int = TOKEN_REFRESH_MARGIN, cache_file: str = TOKEN_CACHE_FILE):
+        self.refresh_margin = refresh_margin
+        self.cache_file = cache_file
+        self._token = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh_task = None
+
+    async def get_token(self) -> str:
+        token, expires_at = self._token, self._expires_at
+        now = time.time()
+        if token and now < self._refresh_at:
+            metrics.token_cache_events.inc("hit")
+            return token
+        if token and now < expires_at:
+            # Still valid: hand it out and refresh ahead of expiry
+            metrics.token_cache_events.inc("hit_refreshing")
+            self._refresh_in_background()
+            return token
+
+        async with self._lock:
+            # Another caller may have refreshed while we waited
+            if self._token and time.time() < self._expires_at:
+                metrics.token_cache_events.inc("coalesced")
+                return self._token
+            await self._refresh()
+            return self._token
+
+    def state(self) -> dict:
+        """Cached token state for /health, without calling Momo"""
+        remaining = self._expires_at - time.time()
+        return {
+            "cached": bool(self._token) and remaining > 0,
+            "expires_in": max(0, int(remaining)),
+            "refreshing": bool(self._refresh_task and not self._refresh_task.done()),
+        }
+
+    async def invalidate(self, token: str = None):
+        """Drop the cached token, e.g. after upstream rejected it with 401"""
+        metrics.token_cache_events.inc("invalidated")
+        if token is None or token == self._token:
+            self._token = None
+            self._expires_at = 0.0
+            self._refresh_at = 0.0
+        if self.cache_file:
+            await asyncio.to_thread(self._invalidate_shared, token)
+
+    def _refresh_in_background(self):
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.create_task(self._background_refresh())
+
+    async def _background_refresh(self):
+        try:
+            async with self._lock:
+                if time.time() < self._refresh_at:
+                    return
+                await self._refresh()
+        except Exception:
+            # Keep serving the current token, the next caller will retry
+            logger.exception("Background token refresh failed")
+
+    def _adopt(self, token: str, expires_in: float):
+        """Cache a freshly minted token; a token shorter-lived than twice the margin is refreshed at half-life"""
+        self._token = token
+        self._expires_at = time.time() + expires_in
+        self._refresh_at = self._expires_at - min(self.refresh_margin, expires_in / 2)
+
+    async def _refresh(self):
+        """Adopt a fresh token from the shared slot, or mint a new one. Caller holds self._lock"""
+        if not self.cache_file:
+            self._adopt(*await _fetch_momo_token())
+            metrics.token_cache_events.inc("refreshed")
+            return
+
+        file_lock = _FileLock(f"{self.cache_file}.lock")
+        await asyncio.to_thread(file_lock.acquire)
+        try:
+            shared = self._read_shared()
+            if shared and time.time() < shared[2]:
+                self._token, self._expires_at, self._refresh_at = shared
+                metrics.token_cache_events.inc("shared")
+                return
+            self._adopt(*await _fetch_momo_token())
+            metrics.token_cache_events.inc("refreshed")
+            self._write_shared(self._token, self._expires_at, self._refresh_at)
+        finally:
+            file_lock.release()
+
+    def _invalidate_shared(self, token: str = None):
+        file_lock = _FileLock(f"{self.cache_file}.lock")
+        file_lock.acquire()
+        try:
+            shared = self._read_shared()
+            if shared and (token is None or shared[0] == token):
+                self._write_shared(shared[0], 0.0, 0.0)
+        finally:
+            file_lock.release()
+
+    def _read_shared(self):
+        try:
+            with open(self.cache_file) as f:
+                data = json.load(f)
+            expires_at = float(data["expires_at"])
+            # Files written before refresh_at was stored
+            refresh_at = float(data.get("refresh_at", expires_at - self.refresh_margin))
+            return data["access_token"], expires_at, refresh_at
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_shared(self, token: str, expires_at: float, refresh_at: float):
+        tmp_path = f"{self.cache_file}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"access_token": token, "expires_at": expires_at, "refresh_at": refresh_at}, f)
+        os.replace(tmp_path, self.cache_file)
+
+
+class _FileLock:
+    """Exclusive lock on a file, used to serialize token refreshes across workers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        self._file = open(self.path, "a")
+        if fcntl:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+
+    def release(self):
+        if fcntl:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+token_manager = MomoTokenManager()
+
+
+async def get_momo_token() -> str:
+    """Get a cached access token from MTN Momo API"""
+    return await token_manager.get_token()
+
+
+async def momo_request(method: str, path: str, headers: dict = None, **kwargs) -> httpx.Response:
+    """Call the Momo API with the cached token, retrying once if it is rejected with 401"""
+    for attempt in range(2):
+        access_token = await get_momo_token()
+        request_headers = {
+            "Authorization": f"Bearer {access_token}",
+            "X-Target-Environment": settings.target_environment,
+            "Ocp-Apim-Subscription-Key": settings.subscription_primary_key,
+        }
+        request_headers.update(headers or {})
+
+        response = await momo_client.send(method, path, headers=request_headers, **kwargs)
+        if response.status_code != 401 or attempt:
+            return response
+        await token_manager.invalidate(access_token)
+    return response
+
+
+async def request_to_pay(reference_id: str, payment_req, shed: bool = True) -> httpx.Response:
+    """Send a PaymentRequest to Momo as request-to-pay `reference_id`"""
+    headers = {
+        "X-Reference-Id": reference_id,
+        "Content-Type": "application/json",
+    }
+    # Ask Momo to push the final status instead of us polling for it
+    if callback_url(reference_id):
+        headers["X-Callback-Url"] = callback_url(reference_id)
+
+    # Create payload - use dynamic phone number for production, test number for sandbox
+    payer_phone = '233454567898' if settings.target_environment == "sandbox" else payment_req.payer_phone_number
+
+    payload = {
+        "amount": payment_req.amount,
+        "currency": payment_req.currency,
+        "externalId": payment_req.external_id,
+        "payer": {
+            "partyIdType": "MSISDN",
+            "partyId": payer_phone
+        },
+        "payerMessage": payment_req.payer_message,
+        "payeeNote": payment_req.payee_note
+    }
+    return await momo_request("POST", "/collection/v1_0/requesttopay", json=payload, headers=headers, shed=shed)
+
+
+async def fetch_payment_status(reference_id: str, shed: bool = True) -> dict:
+    """Get the current state of a request-to-pay from Momo"""
+    response = await momo_request("GET", f"/collection/v1_0/requesttopay/{reference_id}", shed=shed)
+    response.raise_for_status()
+    return response.json()
+
+
+def callback_token(reference_id: str) -> str:
+    """Signature embedded in the callback URL for one reference id"""
+    return hmac.new(CALLBACK_SECRET.encode(), reference_id.encode(), hashlib.sha256).hexdigest()
+
+
+def callback_url(reference_id: str):
+    """X-Callback-Url for a request-to-pay, or None when callbacks are not configured"""
+    if not CALLBACK_URL:
+        return None
+    return f"{CALLBACK_URL.rstrip('/')}/{reference_id}?token={callback_token(reference_id)}"
+
+
+def verify_callback_token(reference_id: str, token: str) -> bool:
+    # Without a secret nothing can be verified, so every callback is rejected
+    if not CALLBACK_SECRET:
+        return False
+    return hmac.compare_digest(callback_token(reference_id), token or "")